@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def clamp(n, minn, maxn):
     return max(min(maxn, n), minn)
 
@@ -51,3 +54,48 @@ class PID:
         self.derror = [0, 0, 0]
         self.perror = [0, 0]
         self.ierror = 0
+
+    def snapshot(self):
+        return list(self.derror), list(self.perror), self.ierror
+
+    def restore(self, state):
+        derror, perror, self.ierror = state
+        self.derror = list(derror)
+        self.perror = list(perror)
+
+
+class PIDBank:
+    # vectorized counterpart of PID, one controller per row of an (N, 3) array of (Kp, Ki, Kd) gains
+    def __init__(self, gains):
+        gains = np.atleast_2d(np.asarray(gains, dtype=float))
+        self.Kp, self.Ki, self.Kd = gains.T
+        self.size = len(gains)
+        self.beta = 0
+        self.gamma = 0
+        self.reset()
+
+    def pid(self, SP, PV, dt):
+        # same velocity form as PID.pid, but every error memory is an array of length N
+        eP = self.beta * SP - PV
+        p = (eP - self.perror) * self.Kp
+        self.perror = eP
+
+        i = self.Ki * (SP - PV) * dt
+
+        eD = self.gamma * SP - PV
+        d = (eD - 2 * self.derror[0] + self.derror[1]) / dt * self.Kd
+        self.derror[1] = self.derror[0]
+        self.derror[0] = eD
+
+        return p + i + d
+
+    def reset(self):
+        self.derror = np.zeros((2, self.size))
+        self.perror = np.zeros(self.size)
+
+    def keep(self, mask):
+        # drop the controllers of abandoned runs
+        self.Kp, self.Ki, self.Kd = self.Kp[mask], self.Ki[mask], self.Kd[mask]
+        self.derror = self.derror[:, mask]
+        self.perror = self.perror[mask]
+        self.size = len(self.Kp)
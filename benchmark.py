@@ -0,0 +1,220 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import numpy as np
+import scipy
+import matplotlib
+import integrator
+import plants
+import system
+from PID import PID
+
+# BENCHMARKS -----------------------------------------------------------------------------------------------------------
+# Machine-readable timings of the simulator, written as one JSON document so releases can be compared:
+#   python benchmark.py -o bench.json [--quick]
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_run(dts, runtimes, repeat):
+    results = []
+    for name in plants.names():
+        sim = system.System(name, checkpoint_every=0)  # no reruns served from checkpoints
+        c = sim.plant.controls
+        for dt in dts:
+            for runtime in runtimes:
+                params = (c['setpoint'], runtime, dt, c['kpset'], c['kiset'], c['kdset'])
+                steps = len(np.arange(0, runtime + dt, dt))
+                seconds = best_of(lambda: sim.run(params), repeat)
+                results.append({'plant': name, 'dt': dt, 'runtime': runtime, 'steps': steps,
+                                'seconds': seconds, 'steps_per_second': steps / seconds})
+    return results
+
+
+def bench_calls(number):
+    def per_call(stmt):
+        return min(timeit.repeat(stmt, number=number, repeat=3)) / number
+
+    controller = PID()
+    results = {'PID.pid': per_call(lambda: controller.pid(10, 5, 1, 1, 1, 0.05))}
+    for name in plants.names():
+        plant = system.get_plant(name)
+        plant.reset()
+        state = plant.batch_state(1)[0][0]
+        results[f'{name}.update'] = per_call(lambda: plant.update(0.0, 0.0, 0.05))
+        results[f'{name}.deriv'] = per_call(lambda: plant.deriv(state, 0.0))
+    return {call: {'seconds_per_call': seconds, 'calls_per_second': 1 / seconds} for call, seconds in results.items()}
+
+
+def bench_solvers(repeat):
+    # cost of one plant.update in closed loop per integration path: seconds per step and right-hand side / Jacobian
+    # evaluations per sample. 'finite differences' leaves out the analytic Jacobian, LSODA that way is the odeint path
+    # from before plants had one.
+    results = []
+    for name in plants.names():
+        for method, jacobian in [(method, jacobian) for method in integrator.IVP_METHODS
+                                 for jacobian in ((False, True) if method in integrator.JACOBIAN_METHODS else (True,))]:
+            sim = system.System(name, checkpoint_every=0, solver={'method': method})
+            plant = sim.plant
+            if not jacobian:
+                plant.jac = None
+            counts, seconds = [], []
+            plant.on_integrate = lambda info: counts.append((info['nfe'][-1], info['nje'][-1]))
+            update = plant.update
+
+            def timed(*args):
+                start = time.perf_counter()
+                fdbk = update(*args)
+                seconds.append(time.perf_counter() - start)
+                return fdbk
+
+            plant.update = timed
+            c = plant.controls
+            params = (c['setpoint'], c['runtime'], c['stepsize'], c['kpset'], c['kiset'], c['kdset'])
+            per_step = []
+            for _ in range(repeat):
+                counts.clear()
+                seconds.clear()
+                sim.run(params)
+                per_step.append(sum(seconds) / len(seconds))
+            nfe, nje = np.mean(counts, axis=0)
+            results.append({'plant': name, 'method': method,
+                            'jacobian': 'analytic' if jacobian else 'finite differences',
+                            'steps': len(seconds), 'update_seconds': min(per_step),
+                            'rhs_per_sample': float(nfe), 'jac_per_sample': float(nje)})
+    return results
+
+
+def bench_sweep(worker_counts, grid, runtime):
+    results = []
+    values = np.linspace(0, 100, grid)
+    for workers in worker_counts:
+        start = time.perf_counter()
+        table = system.sweep('2nd Order ODE', values, values, [0, 10], runtime=runtime, workers=workers)
+        seconds = time.perf_counter() - start
+        results.append({'workers': workers, 'runs': len(table), 'seconds': seconds,
+                        'runs_per_second': len(table) / seconds})
+    return results
+
+
+def bench_redraw(repeat):
+    # MyFrame.plot without wx, rendered by Agg: the canvas size and the frame's figure, the step response above and the
+    # Bode plot of the loop (magnitude, phase on a twin axis, crossovers and margins) below, their BlitPlotters linked
+    # so a full layout pass redraws and recaptures both
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from plotter import BlitPlotter, GhostOverlay, LODLine
+
+    figure = Figure(figsize=(7, 4.9), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot(211)
+    ax2 = figure.add_subplot(212)
+    ax3 = ax2.twinx()
+    ax.grid()
+    ax2.grid()
+    step, = ax.plot([], [], linestyle='-')
+    magnitude, = ax2.semilogx([], [], linestyle='-')
+    phase, = ax3.semilogx([], [], linestyle='--', color='tab:orange')
+    crossovers = [ax2.axvline(1, linestyle=':', color='gray') for _ in range(2)]
+    margin_text = ax2.text(0.01, 0.04, '', transform=ax2.transAxes)
+    blitter = BlitPlotter(figure, canvas, ax, [step])
+    bode_blitter = BlitPlotter(figure, canvas, ax2, [magnitude, phase, *crossovers, margin_text])
+    blitter.link(bode_blitter)
+
+    sim = system.System('Reactor')
+    c = sim.plant.controls
+    params = (c['setpoint'], c['runtime'], c['stepsize'], c['kpset'], c['kiset'], c['kdset'])
+    x, y = sim.run(params)
+    analysis = sim.loop_analysis(params)
+    phase.set_data(analysis['w'], np.mod(analysis['phase'], 360) - 360)
+    for line, crossover in zip(crossovers, ('gain_crossover', 'phase_crossover')):
+        line.set_xdata([analysis[crossover]] * 2)
+    margin_text.set_text(f"GM {analysis['gain_margin']:.1f} dB   PM {analysis['phase_margin']:.1f} deg")
+    magnitude.set_data(analysis['w'], analysis['magnitude'])
+    bode_blitter.draw(analysis['w'], analysis['magnitude'])
+
+    def redraw(y):
+        step.set_data(x, y)
+        blitter.draw(x, y)
+
+    redraw(y)
+    blit = best_of(lambda: redraw(y * 1.001), repeat)
+    full = best_of(lambda: (blitter.invalidate(), redraw(y)), repeat)
+    results = {'points': len(x), 'blit_seconds': blit, 'full_layout_seconds': full, 'lod': []}
+
+    # long trajectories through the level-of-detail stage, the cost should not grow with the length
+    lod = LODLine(step)
+    for points in (10 ** 3, 10 ** 5, 10 ** 6):
+        x = np.linspace(0, 100, points)
+        y = np.sin(x) * np.exp(-x / 50) + 0.01 * np.random.default_rng(0).standard_normal(points)
+
+        def redraw_lod(y):
+            lod.set_data(x, y)
+            blitter.draw(x, y)
+
+        redraw_lod(y)
+        results['lod'].append({'points': points, 'drawn': len(step.get_xdata()),
+                               'blit_seconds': best_of(lambda: redraw_lod(y * 1.001), repeat),
+                               'full_layout_seconds': best_of(lambda: (blitter.invalidate(), redraw_lod(y)), repeat)})
+
+    # a family of ghost traces under the live line: adding one run, recomposing the background, blitting on top
+    ghosts = GhostOverlay(ax, capacity=200)
+    blitter.static = [ghosts.collection]
+    Y = y + 0.1 * np.random.default_rng(1).standard_normal((200, 1))
+    ghosts.add(x, Y)
+    blitter.invalidate()
+    redraw_lod(y)
+    results['ghosts'] = {'runs': len(Y), 'points': len(x), 'drawn': sum(len(s) for s in ghosts.segments),
+                         'add_run_seconds': best_of(lambda: ghosts.add(x, Y[0]), repeat),
+                         'compose_seconds': best_of(lambda: (blitter.invalidate_static(), redraw_lod(y)), repeat),
+                         'blit_seconds': best_of(lambda: redraw_lod(y * 1.001), repeat)}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the PID simulator.')
+    parser.add_argument('-o', '--output', default=None, help='write JSON here instead of stdout')
+    parser.add_argument('--quick', action='store_true', help='smaller matrices for a fast smoke run')
+    args = parser.parse_args(argv)
+
+    cpus = os.cpu_count() or 1
+    if args.quick:
+        dts, runtimes, repeat, number, grid = [0.05], [5], 1, 200, 3
+    else:
+        dts, runtimes, repeat, number, grid = [0.05, 0.01], [10, 30], 3, 2000, 6
+    worker_counts = sorted({1, 2, 4, cpus} if not args.quick else {1, cpus})
+
+    report = {
+        'meta': {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'python': sys.version.split()[0], 'numpy': np.__version__, 'scipy': scipy.__version__,
+                 'matplotlib': matplotlib.__version__, 'platform': platform.platform(), 'cpus': cpus},
+        'run': bench_run(dts, runtimes, repeat),
+        'calls': bench_calls(number),
+        'solvers': bench_solvers(repeat),
+        'sweep': bench_sweep(worker_counts, grid, runtime=10),
+        'redraw': bench_redraw(max(repeat, 5)),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
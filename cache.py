@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import threading
+
+
+class ResultCache:
+    # Bounded LRU memo of System.run results. Entries are keyed by plant name, plant constants and the simulation
+    # parameters; the size budget counts the bytes of the stored trajectories.
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.fingerprints = {}  # plant name -> constants the cached entries were computed with
+        self._lock = threading.Lock()
+
+    def key(self, plant_name, plant, params, *options):
+        fingerprint = tuple(sorted(plant.parameters().items()))
+        with self._lock:
+            if self.fingerprints.get(plant_name, fingerprint) != fingerprint:
+                self._invalidate(plant_name)  # plant constants changed, everything cached for it is stale
+            self.fingerprints[plant_name] = fingerprint
+        return (plant_name, fingerprint, tuple(float(p) for p in params)) + options
+
+    def get(self, key):
+        with self._lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        x, y = result
+        size = x.nbytes + y.nbytes
+        if size > self.max_bytes:
+            return result  # would evict everything else for a single entry
+        x.flags.writeable = False  # shared with every later hit
+        y.flags.writeable = False
+        with self._lock:
+            if key in self.entries:
+                self.nbytes -= self._size(self.entries.pop(key))
+            self.entries[key] = result
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._size(self.entries.popitem(last=False)[1])
+        return result
+
+    def invalidate(self, plant_name=None):
+        with self._lock:
+            self._invalidate(plant_name)
+
+    def _invalidate(self, plant_name):
+        for key in [key for key in self.entries if plant_name is None or key[0] == plant_name]:
+            self.nbytes -= self._size(self.entries.pop(key))
+
+    def clear(self):
+        self.invalidate()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def _size(result):
+        return result[0].nbytes + result[1].nbytes
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+class DataLog:
+    # Preallocated structured log of plant channels. Logging is opt-in: with no channels selected, append is never
+    # called by the plants and nothing is allocated.
+    def __init__(self, channels, selected=None):
+        self.channels = tuple(channels)
+        if selected is True:
+            selected = self.channels
+        self.selected = tuple(selected or ())
+        unknown = set(self.selected) - set(self.channels)
+        if unknown:
+            raise ValueError(f'Unknown log channels {sorted(unknown)}, expected any of {self.channels}')
+
+        self.dtype = np.dtype([(name, float) for name in self.selected])
+        self.index = [self.channels.index(name) for name in self.selected]
+        self.enabled = bool(self.selected)
+        self.data = np.empty(0, dtype=self.dtype)
+        self.n = 0
+
+    def allocate(self, samples):
+        self.data = np.empty(samples if self.enabled else 0, dtype=self.dtype)
+        self.n = 0
+
+    def append(self, row):
+        # row holds a value for every channel, in self.channels order
+        if self.n == len(self.data):
+            self.data = np.resize(self.data, max(16, 2 * len(self.data)))  # plant stepped past the sized run
+        self.data[self.n] = tuple(row[i] for i in self.index)
+        self.n += 1
+
+    def view(self):
+        return self.data[:self.n]
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+from scipy.optimize import fsolve
+from scipy.signal import cont2discrete
+
+# LOOP ANALYSIS --------------------------------------------------------------------------------------------------------
+# Stability margins without integrating anything. The plant is linearized at the steady state where its output sits
+# on the setpoint (A from plant.jac_batch, B from the input derivative of plant.deriv_batch) and discretized with the
+# same zero-order hold the simulation applies, so the sampled loop
+#
+#   L(z) = C(z) * input_sign * c (zI - Ad)^-1 Bd,    C(z) = Kp + Ki dt / (1 - 1/z) + Kd (1 - 1/z) / dt
+#
+# is exactly the loop System.run closes (C(z) is the positional form of the velocity PID, beta and gamma only act on
+# the setpoint). The plant part only depends on the operating point and dt and is cached; gains only scale C(z).
+
+CACHE_SIZE = 64
+_responses = OrderedDict()
+_lock = threading.Lock()
+
+
+def operating_point(plant, setpoint, t=0.0):
+    # state and plant input with deriv = 0 and the fed back state at the setpoint, solved from the initial condition
+    X, u = plant.batch_state(1)
+    x0, u0 = X[0].astype(float), float(u[0])
+    out = plant.output_state
+    free = [i for i in range(len(x0)) if i != out]
+
+    def state(z):
+        x = x0.copy()
+        x[out] = setpoint
+        x[free] = z[:-1]
+        return x
+
+    def residual(z):
+        return plant.deriv_batch(state(z)[None], t, np.array([z[-1]]))[0]
+
+    z, info, ier, message = fsolve(residual, np.append(x0[free], u0), full_output=True)
+    if ier != 1 or not np.allclose(info['fvec'], 0, atol=1e-6 * max(1.0, abs(setpoint))):
+        raise ValueError(f'{type(plant).__module__} has no steady state at output {setpoint}: {message}')
+    return state(z), z[-1]
+
+
+def linearize(plant, setpoint, t=0.0):
+    # continuous (A, B, c) around the operating point, B by central difference since the input enters deriv directly
+    x, u = operating_point(plant, setpoint, t)
+    A = np.array(plant.jac_batch(x[None], t, np.array([u]))[0], dtype=float)
+    h = 1e-6 * max(1.0, abs(u))
+    B = (plant.deriv_batch(x[None], t, np.array([u + h]))[0]
+         - plant.deriv_batch(x[None], t, np.array([u - h]))[0]) / (2 * h)
+    c = np.zeros(len(x))
+    c[plant.output_state] = 1.0
+    return x, u, A, B, c
+
+
+def plant_response(plant, setpoint, dt, t=0.0, points=400, decades=5):
+    # (w, P, operating point) of the sampled plant over a log grid up to just below Nyquist, cached per plant
+    # constants, operating point and dt
+    if dt <= 0:
+        raise ValueError(f'dt has to be positive, got {dt}')
+    key = (type(plant).__module__, float(setpoint), float(dt), float(t), points, decades,
+           tuple(sorted(plant.parameters().items())))
+    with _lock:
+        if key in _responses:
+            _responses.move_to_end(key)
+            return _responses[key]
+
+    x, u, A, B, c = linearize(plant, setpoint, t)
+    Ad, Bd, *_ = cont2discrete((A, B[:, None], c[None], np.zeros((1, 1))), dt, method='zoh')
+    nyquist = np.pi / dt
+    w = np.logspace(np.log10(nyquist) - decades, np.log10(0.999 * nyquist), points)
+    z = np.exp(1j * w * dt)
+    n = len(A)
+    M = z[:, None, None] * np.eye(n) - Ad
+    P = plant.input_sign * (np.linalg.solve(M, np.broadcast_to(Bd, (points, n, 1)))[:, :, 0] @ c)
+    for array in (w, P, x):
+        array.flags.writeable = False
+    result = w, P, (x, u)
+
+    with _lock:
+        _responses[key] = result
+        while len(_responses) > CACHE_SIZE:
+            _responses.popitem(last=False)
+    return result
+
+
+def controller_response(w, dt, Kp, Ki, Kd):
+    delta = 1 - np.exp(-1j * w * dt)  # 1 - 1/z
+    return Kp + Ki * dt / delta + Kd * delta / dt
+
+
+def margins(w, L):
+    # the smallest gain margin (dB) and phase margin (deg) over all crossovers, inf when the curve never crosses
+    result = {'gain_margin': np.inf, 'phase_crossover': np.nan, 'phase_margin': np.inf, 'gain_crossover': np.nan}
+    logw = np.log(w)
+
+    mag = np.log(np.abs(L))
+    i = np.flatnonzero(np.sign(mag[:-1]) != np.sign(mag[1:]))
+    if len(i):
+        frac = mag[i] / (mag[i] - mag[i + 1])
+        pm = np.degrees(np.angle(-(L[i] + frac * (L[i + 1] - L[i]))))  # phase + 180, wrapped to (-180, 180]
+        j = np.argmin(pm)
+        result['phase_margin'] = float(pm[j])
+        result['gain_crossover'] = float(np.exp(logw[i[j]] + frac[j] * (logw[i[j] + 1] - logw[i[j]])))
+
+    im = L.imag
+    i = np.flatnonzero(np.sign(im[:-1]) != np.sign(im[1:]))
+    frac = im[i] / (im[i] - im[i + 1])
+    re = L.real[i] + frac * (L.real[i + 1] - L.real[i])
+    i, frac, re = i[re < 0], frac[re < 0], re[re < 0]  # only crossings of the negative real axis count
+    if len(i):
+        gm = -20 * np.log10(-re)
+        j = np.argmin(gm)
+        result['gain_margin'] = float(gm[j])
+        result['phase_crossover'] = float(np.exp(logw[i[j]] + frac[j] * (logw[i[j] + 1] - logw[i[j]])))
+    return result
+
+
+def analyze(plant, setpoint, dt, Kp, Ki, Kd, t=0.0, points=400):
+    w, P, (x, u) = plant_response(plant, setpoint, dt, t, points)
+    L = controller_response(w, dt, Kp, Ki, Kd) * P
+    with np.errstate(divide='ignore'):  # all gains zero leaves nothing to plot but -inf dB
+        result = {'w': w, 'L': L, 'magnitude': 20 * np.log10(np.abs(L)), 'phase': np.degrees(np.angle(L)),
+                  'state': x, 'input': u}
+        result.update(margins(w, L))
+    return result
@@ -2,11 +2,36 @@ import wx
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from matplotlib.backends.backend_wxagg import NavigationToolbar2WxAgg as NavigationToolbar
+from collections import deque
+import os
+import queue
 import threading
 import numpy as np
 import time
+import plants
 import system
+import tuner
+from cache import ResultCache
 from FloatSlider import FloatSlider
+from plotter import BlitPlotter, GhostOverlay, LODLine, TraceBuffer
+from sim_worker import SimulationWorker
+from trajstore import TrajectoryStore
+
+
+GHOSTS = 20  # earlier responses kept behind the live one
+FAMILY_TIP = 'Overlay every stored run of this plant, setpoint, runtime and step size (needs PID_TRAJECTORY_STORE)'
+OPEN_WINDOW = 10.0  # seconds first shown of an open-ended run, doubled each time the trace reaches the edge
+
+
+def x_span(x, runtime):
+    # the axis spans the whole run from the first chunk. An open-ended one (runtime inf) gets a window that doubles,
+    # so the limits and the full redraw they need change a logarithmic number of times.
+    if np.isfinite(runtime):
+        return x[0], max(runtime, x[-1])
+    window = OPEN_WINDOW
+    while x[0] + window < x[-1]:
+        window *= 2
+    return x[0], x[0] + window
 
 
 def toFloat(s):
@@ -29,7 +54,7 @@ class MyFrame(wx.Frame):
         # (LEFT) Settings Panel ----------------------------------------------------------------------------------------
         self.left_panel = wx.Panel(self.panel_2, wx.ID_ANY)
         self.plant_combo_box = wx.ComboBox(self.left_panel, wx.ID_ANY,
-                                           choices=['Reactor', 'DC Motor', 'Water Boiler', '2nd Order ODE'],
+                                           choices=list(plants.names()),
                                            style=wx.CB_DROPDOWN)
         self.setpoint_text_ctrl = wx.TextCtrl(self.left_panel, wx.ID_ANY, "390")
         self.runtime_text_ctrl = wx.TextCtrl(self.left_panel, wx.ID_ANY, "8")
@@ -46,6 +71,10 @@ class MyFrame(wx.Frame):
         # self.slider_3 = wx.Slider(self.left_panel, wx.ID_ANY, value=5, minValue=0, maxValue=10,
         #                           style=wx.SL_AUTOTICKS | wx.SL_HORIZONTAL | wx.SL_MIN_MAX_LABELS)
         self.slider_3 = FloatSlider(self.left_panel, value=0.5, minVal=0, maxVal=1, label='Kd', id='Kd')
+        self.cost_combo_box = wx.ComboBox(self.left_panel, wx.ID_ANY, choices=list(tuner.COSTS),
+                                          style=wx.CB_DROPDOWN | wx.CB_READONLY)
+        self.tune_button = wx.Button(self.left_panel, wx.ID_ANY, "Auto-tune")
+        self.family_button = wx.ToggleButton(self.left_panel, wx.ID_ANY, "Stored runs")
 
         # (RIGHT) PLOT Panel -------------------------------------------------------------------------------------------
         self.right_panel = wx.Panel(self.panel_2, wx.ID_ANY, style=wx.SIMPLE_BORDER)
@@ -55,16 +84,40 @@ class MyFrame(wx.Frame):
         self.toolbar = NavigationToolbar(self.canvas)
         self.toolbar.Realize()
 
-        self.ax1 = self.figure.add_subplot(111)
-        # self.ax1 = self.figure.add_subplot(211)
-        # self.ax2 = self.figure.add_subplot(212)
+        self.ax1 = self.figure.add_subplot(211)
+        self.ax2 = self.figure.add_subplot(212)
+        self.ax3 = self.ax2.twinx()  # phase of the loop response
         self.step, = self.ax1.plot([], [], linestyle='-')
         # self.temporal, = self.ax1.plot([], [], linestyle='-')
-        # self.spectral, = self.ax2.plot([], [], color='red')
+        self.magnitude, = self.ax2.semilogx([], [], linestyle='-')
+        self.phase, = self.ax3.semilogx([], [], linestyle='--', color='tab:orange')
+        self.crossovers = [self.ax2.axvline(1, linestyle=':', color='gray') for _ in range(2)]  # gain, phase
+        self.margin_text = self.ax2.text(0.01, 0.04, '', transform=self.ax2.transAxes)
+        self.lod = LODLine(self.step)  # the line only gets about two points per pixel of the full trajectory
+        self.ghosts = GhostOverlay(self.ax1, GHOSTS)  # earlier responses (or the stored family) under the live line
+        self.last_result = None  # the response on screen, it turns into a ghost when the next one arrives
+        self.history = deque(maxlen=GHOSTS)  # the earlier responses, kept while the stored family is shown
+        self.blitter = BlitPlotter(self.figure, self.canvas, self.ax1, [self.step], static=[self.ghosts.collection])
+        self.bode_blitter = BlitPlotter(self.figure, self.canvas, self.ax2,
+                                        [self.magnitude, self.phase, *self.crossovers, self.margin_text])
+        self.blitter.link(self.bode_blitter)
 
         self.plot_title = 'Step Plot'
         self.yaxis_label = 'Amplitude'
         self.system = None
+        self.cache = ResultCache()  # slider positions repeat a lot, shared across plant changes
+        # runs persisted across sessions (and shared with sweeps and scenario runs) when PID_TRAJECTORY_STORE is set
+        store = os.environ.get('PID_TRAJECTORY_STORE')
+        self.archive = TrajectoryStore(store) if store else None
+        # simulations run off the main thread and stream their chunks into a queue the plot timer drains, the complete
+        # result comes back through wx.CallAfter
+        self.chunks = queue.Queue()
+        self.live = None  # (generation, TraceBuffer) of the run being streamed
+        self.plotted = 0  # generation whose result is on screen, chunks of it arriving late are dropped
+        self.submitted = None  # (params, instrumentation runs before it) of the latest request
+        self.worker = SimulationWorker(lambda generation, result: wx.CallAfter(self.on_result, generation, result),
+                                       on_chunk=lambda generation, t, y: self.chunks.put((generation, t, y)))
+        self.stream_timer = wx.Timer(self)
 
         # EVENT HANDLES ------------------------------------------------------------------------------------------------
         self.Bind(wx.EVT_COMBOBOX, lambda event: self.report_combo(event, "plant"), self.plant_combo_box)
@@ -75,6 +128,8 @@ class MyFrame(wx.Frame):
         self.Bind(wx.EVT_CHECKBOX, lambda event: self.report_checkbox(event, self.slider_1, 'Kp'), self.pCheck)
         self.Bind(wx.EVT_CHECKBOX, lambda event: self.report_checkbox(event, self.slider_2, 'Ki'), self.iCheck)
         self.Bind(wx.EVT_CHECKBOX, lambda event: self.report_checkbox(event, self.slider_3, 'Kd'), self.dCheck)
+        self.Bind(wx.EVT_BUTTON, self.on_autotune, self.tune_button)
+        self.Bind(wx.EVT_TOGGLEBUTTON, self.on_family, self.family_button)
 
         # self.Bind(wx.EVT_SLIDER, lambda event: self.report_slider(event, "Kp"), self.slider_1)
         # self.Bind(wx.EVT_SLIDER, lambda event: self.report_slider(event, "Ki"), self.slider_2)
@@ -90,6 +145,9 @@ class MyFrame(wx.Frame):
                                   lambda event: self.report_slider(event, self.slider_2))
         self.slider_3.slider.Bind(wx.EVT_COMMAND_SCROLL_THUMBTRACK,
                                   lambda event: self.report_slider(event, self.slider_3))
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.Bind(wx.EVT_TIMER, self.on_stream_timer, self.stream_timer)
+        self.stream_timer.Start(15)
         self.Freeze()
         self.__set_properties()
         self.__do_layout()
@@ -105,6 +163,9 @@ class MyFrame(wx.Frame):
         self.pCheck.SetValue(1)
         self.iCheck.SetValue(1)
         self.dCheck.SetValue(1)
+        self.cost_combo_box.SetSelection(0)
+        self.family_button.Enable(self.archive is not None)
+        self.family_button.SetToolTip(FAMILY_TIP)
         self.left_panel.SetMinSize((310, 502))
         self.right_panel.SetMinSize((700, 502))
         self.canvas.SetMinSize((700, 490))
@@ -180,6 +241,11 @@ class MyFrame(wx.Frame):
         sizer_5.Add(label_10, 0, 0, 0)
         sizer_5.Add(self.slider_3, 0, wx.EXPAND, 0)
         grid_sizer_3.Add(sizer_5, (13, 1), (1, 1), wx.EXPAND, 0)
+        sizer_6 = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_6.Add(self.cost_combo_box, 0, wx.RIGHT, 5)
+        sizer_6.Add(self.tune_button, 0, wx.RIGHT, 5)
+        sizer_6.Add(self.family_button, 0, 0, 0)
+        grid_sizer_3.Add(sizer_6, (14, 0), (1, 2), wx.TOP, 10)
         self.left_panel.SetSizer(grid_sizer_3)
         grid_sizer_1.Add(self.left_panel, (0, 0), (1, 1), wx.EXPAND, 0)
         self.right_panel.SetSizer(grid_sizer_2)
@@ -220,7 +286,15 @@ class MyFrame(wx.Frame):
 
     # ------------------------------------------------------------------------------------------------------------------
     def setup(self):
-        self.system = system.System(self.get_plant())
+        self.system = system.System(self.get_plant(), cache=self.cache, archive=self.archive)
+        self.last_result = None
+        self.history.clear()
+        self.ghosts.clear(GHOSTS)  # other plant, other units
+        self.family_button.SetValue(False)
+        self.family_button.SetToolTip(FAMILY_TIP)
+        self.blitter.invalidate_static()
+        for blitter in self.blitter.group:
+            blitter.autoscale()  # a zoom into the previous plant's curves means nothing here
         control_params = self.system.plant.controls
         plot_params = self.system.plant.plot_settings
 
@@ -229,10 +303,59 @@ class MyFrame(wx.Frame):
         self.update_plot_labels(plot_params)
 
     def update(self):
-        x, y = self.system.run(self.get_values())
+        # latest wins: this supersedes (and aborts) whatever the worker is still computing
+        params = self.get_values()
+        self.plot_loop(params)  # milliseconds, the Bode plot follows the sliders without simulating
+        inst = self.system.instrumentation
+        self.submitted = (tuple(params), 0 if inst is None else len(inst.runs))
+        self.worker.submit(self.system, params)
+
+    def on_stream_timer(self, evt):
+        # draws whatever the worker streamed since the last tick
+        received = False
+        while True:
+            try:
+                generation, t, y = self.chunks.get_nowait()
+            except queue.Empty:
+                break
+            if not self.worker.is_current(generation) or generation == self.plotted:
+                continue
+            if self.live is None or self.live[0] != generation:
+                self.live = (generation, TraceBuffer())
+            self.live[1].extend(t, y)  # bounded, an open-ended run does not pile up
+            received = True
+        if received:
+            x, y = self.live[1].data()
+            self.lod.set_data(x, y)
+            runtime = self.get_values()[1]
+            self.blitter.draw(x_span(x, runtime), y)
+
+    def on_result(self, generation, result):
+        if not self.worker.is_current(generation):
+            return  # a newer request was submitted while this one was waiting on the main thread
+        self.live = None
+        self.plotted = generation
+        x, y = result
+        if self.last_result is not None and y is not self.last_result[1]:
+            self.history.append(self.last_result)
+            if not self.family_button.GetValue():
+                self.ghosts.add(*self.last_result)  # only decimates this one run
+                self.blitter.invalidate_static()
+        self.last_result = result
+        inst = self.system.instrumentation
+        params, runs = self.submitted
+        record = inst.runs[-1] if inst is not None and len(inst.runs) > runs else None
+        if record is None or not record['completed'] or record['params'] != params:
+            self.plot({'x': x, 'y': y})  # served from the cache, no run of this request to charge
+        else:
+            start = time.perf_counter()
+            self.plot({'x': x, 'y': y})
+            inst.add_phase('plot', time.perf_counter() - start)
 
-        self.plot({'x': x, 'y': y})
-        time.sleep(0.01)
+    def on_close(self, evt):
+        self.stream_timer.Stop()
+        self.worker.stop()
+        evt.Skip()
 
     def set_simulation(self, params):
         self.setpoint_text_ctrl.SetValue(str(params['setpoint']))
@@ -275,57 +398,124 @@ class MyFrame(wx.Frame):
             slider.Enable()
         self.update()
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def on_autotune(self, evt):
+        # tunes on its own System in a background thread so the simulation worker keeps serving the sliders
+        plant = self.get_plant()
+        setpoint, runtime, stepsize = self.get_values()[:3]
+        cost = self.cost_combo_box.GetStringSelection()
+        controls = self.system.plant.controls
+        bounds = [(controls[f'{k}min'], controls[f'{k}max']) if slider.IsEnabled() else (0, 0)
+                  for k, slider in (('kp', self.slider_1), ('ki', self.slider_2), ('kd', self.slider_3))]
+        print(f'Auto-tuning {plant} for {cost}')
+        self.tune_button.Disable()
+
+        def work():
+            try:
+                result = system.System(plant).autotune(setpoint, runtime, stepsize, cost, bounds=bounds)
+            except Exception as e:
+                print(f'Auto-tune failed: {e}')
+                result = None
+            wx.CallAfter(self.on_tuned, plant, result)
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def on_tuned(self, plant, result):
+        self.tune_button.Enable()
+        if result is None or plant != self.get_plant():
+            return
+        Kp, Ki, Kd = result['gains']
+        print(f"Auto-tune {result['metric']} = {result['cost']:.4g} at Kp={Kp:.4g}, Ki={Ki:.4g}, Kd={Kd:.4g} "
+              f"({result['evaluated']} candidates)")
+        # the sliders only hold their divisions, so the gains end up snapped
+        self.slider_1.SetValue(Kp)
+        self.slider_2.SetValue(Ki)
+        self.slider_3.SetValue(Kd)
+        self.update()
+
+    def on_family(self, evt):
+        # toggles the ghosts between the run history and every stored run matching the current settings (a sweep's
+        # family of curves)
+        self.ghosts.clear(GHOSTS)
+        self.family_button.SetToolTip(FAMILY_TIP)
+        if not self.family_button.GetValue():
+            for x, y in self.history:
+                self.ghosts.add(x, y)
+        else:
+            params = self.get_values()
+            key = self.archive.key(self.system.plant_name, self.system.plant, params, *self.system.options())
+            setpoint, runtime, stepsize = params[:3]
+            rows = self.archive.query(self.system.plant_name, setpoint=setpoint, runtime=runtime, dt=stepsize)
+            rows = rows[self.archive.index['digest'][rows] == key[1]]  # same plant constants and options
+            curves = [self.archive.load(row) for row in rows]
+            self.family_button.SetToolTip(f'{len(curves)} stored runs shown')
+            self.ghosts.clear(max(GHOSTS, len(curves)))
+            for length in sorted({len(x) for x, y in curves}):
+                group = [(x, y) for x, y in curves if len(x) == length]
+                self.ghosts.add(group[0][0], np.array([y for x, y in group]))  # one vectorized decimation per grid
+        self.blitter.invalidate_static()
+        if self.last_result is not None:
+            self.blitter.draw(*self.last_result)
+
     # ------------------------------------------------------------------------------------------------------------------
     def __do_plot_layout(self):
         self.ax1.set_title(self.plot_title)
         self.ax1.set_xlabel('TIME (s)')
         self.ax1.set_ylabel(self.yaxis_label)
         self.ax1.grid()
-        # self.ax2.set_title('DIGITIZED WAVEFORM SPECTRAL RESPONSE')
-        # self.ax2.set_xlabel('FREQUENCY (kHz)')
-        # self.ax2.set_ylabel('MAGNITUDE (dB)')
-        # self.ax2.grid()
-        # self.figure.align_ylabels([self.ax1, self.ax2])
-        self.figure.align_ylabels([self.ax1])
+        self.ax2.set_title('OPEN LOOP RESPONSE (PID x PLANT)')
+        self.ax2.set_xlabel('FREQUENCY (rad/s)')
+        self.ax2.set_ylabel('MAGNITUDE (dB)')
+        self.ax2.grid()
+        self.ax3.set_ylabel('PHASE (deg)')
+        self.ax3.set_ylim(-360, 0)
+        self.ax3.set_yticks(np.arange(-360, 1, 90))
+        self.figure.align_ylabels([self.ax1, self.ax2])
         self.figure.tight_layout()
 
     def update_plot_labels(self, params):
         self.ax1.set_xlabel(params['xlabel'])
         self.ax1.set_ylabel(params['ylabel'])
         self.ax1.set_title(params['title'])
+        self.blitter.invalidate()  # labels live in the cached background
 
     def plot(self, data):
         # TEMPORAL -----------------------------------------------------------------------------------------------------
         x = data['x']
         y = data['y']
 
-        self.step.set_data(x, y)
+        self.lod.set_data(x, y)
         # ylimit = np.max(np.abs(y)) * 1.25
         # increment = ylimit / 4
         # self.ax1.set_yticks(np.arange(-ylimit, ylimit + increment, increment))
-        self.ax1.relim()  # recompute the ax.dataLim
-        self.ax1.autoscale()
-
-        # SPECTRAL -----------------------------------------------------------------------------------------------------
-        # xf = data['xf']
-        # ywf = data['ywf']
-        # Fs = data['Fs']
-        # N = data['N']
-        # yrms = data['yrms']
-        #
-        # # divide by number of samples to keep the scaling.
-        # self.spectral.set_data(xf[0:N] / 1000, 20 * np.log10(2 * np.abs(ywf[0:N] / (yrms * N))))
-        #
-        # xf_max = min(10 ** (np.ceil(np.log10(F0)) + 1), Fs / 2 - Fs / N)  # Does not exceed max bin
-        # self.ax2.set_xlim(np.min(xf) / 1000, xf_max / 1000)
-        # self.ax2.set_ylim(-150, 0)
 
         # UPDATE PLOT FEATURES -----------------------------------------------------------------------------------------
-        self.figure.tight_layout()
+        # blits the line over the cached background, full layout only when the limits have to move
+        if self.blitter.draw(x, y):
+            self.toolbar.update()  # Not sure why this is needed - ADS
 
-        self.toolbar.update()  # Not sure why this is needed - ADS
-        self.canvas.draw()
-        self.canvas.flush_events()
+    def plot_loop(self, params):
+        # SPECTRAL -----------------------------------------------------------------------------------------------------
+        try:
+            analysis = self.system.loop_analysis(params)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            print(f'Loop analysis failed: {e}')
+            analysis = None
+
+        if analysis is None:
+            w = magnitude = np.empty(0)
+            self.phase.set_data(w, w)
+            for line in self.crossovers:
+                line.set_xdata([np.nan, np.nan])
+            self.margin_text.set_text('no loop analysis for these settings')
+        else:
+            w, magnitude = analysis['w'], analysis['magnitude']
+            self.phase.set_data(w, np.mod(analysis['phase'], 360) - 360)
+            for line, crossover in zip(self.crossovers, ('gain_crossover', 'phase_crossover')):
+                line.set_xdata([analysis[crossover]] * 2)
+            self.margin_text.set_text(f"GM {analysis['gain_margin']:.1f} dB   PM {analysis['phase_margin']:.1f} deg")
+        self.magnitude.set_data(w, magnitude)
+        self.bode_blitter.draw(w, magnitude)
 
 
 class MyApp(wx.App):
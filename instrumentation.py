@@ -0,0 +1,124 @@
+from collections import defaultdict
+import threading
+import time
+
+PHASES = ('pid', 'plant', 'deriv', 'plot')
+
+
+class Instrumentation:
+    # Opt-in timing for System.run. Attach with System(..., instrumentation=Instrumentation()); when nothing is
+    # attached the simulation loop skips all of this. Subscribers are called as callback(event, record) with the
+    # events 'run_start', 'run_end' and 'plot'.
+    def __init__(self):
+        self.runs = []
+        self.current = None
+        self.subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def emit(self, event, record):
+        for callback in list(self.subscribers):
+            callback(event, record)
+
+    # RUN RECORDS ------------------------------------------------------------------------------------------------------
+    def begin_run(self, plant_name, plant, params):
+        record = {'plant': plant_name, 'params': tuple(params), 'steps': 0, 'wall': 0.0,
+                  'phases': dict.fromkeys(PHASES, 0.0), 'integrator_calls': 0, 'rhs_evals': 0, 'jac_evals': 0,
+                  'max_rhs_per_call': 0, 'completed': False, '_start': time.perf_counter()}
+        self.current = record
+
+        # time the RHS from inside odeint and collect its full_output info. Remote plants have no local RHS, their
+        # round trips end up in the plant phase.
+        deriv = getattr(plant, 'deriv', None)
+
+        def timed_deriv(*args):
+            start = time.perf_counter()
+            result = deriv(*args)
+            record['phases']['deriv'] += time.perf_counter() - start
+            return result
+
+        if deriv is not None:
+            plant.deriv = timed_deriv
+        plant.on_integrate = self.integrator_call
+        self.emit('run_start', record)
+        return record
+
+    def step(self, pid_seconds, plant_seconds):
+        phases = self.current['phases']
+        phases['pid'] += pid_seconds
+        phases['plant'] += plant_seconds
+        self.current['steps'] += 1
+
+    def integrator_call(self, info):
+        record = self.current
+        nfe = int(info['nfe'][-1])
+        record['integrator_calls'] += 1
+        record['rhs_evals'] += nfe
+        record['jac_evals'] += int(info['nje'][-1])
+        record['max_rhs_per_call'] = max(record['max_rhs_per_call'], nfe)
+
+    def end_run(self, plant, completed=True):
+        record = self.current
+        record['wall'] = time.perf_counter() - record.pop('_start')
+        record['completed'] = completed
+        plant.__dict__.pop('deriv', None)  # drop the instance wrapper, back to the class method
+        plant.on_integrate = None
+        with self._lock:
+            self.runs.append(record)
+        self.current = None
+        self.emit('run_end', record)
+        return record
+
+    def add_phase(self, phase, seconds):
+        # phases measured outside of System.run (plotting) are charged to the most recent run
+        with self._lock:
+            if not self.runs:
+                return
+            record = self.runs[-1]
+            record['phases'][phase] = record['phases'].get(phase, 0.0) + seconds
+        self.emit(phase, record)
+
+    # REPORTING --------------------------------------------------------------------------------------------------------
+    def summary(self):
+        plants = defaultdict(lambda: {'runs': 0, 'steps': 0, 'wall': 0.0, 'phases': dict.fromkeys(PHASES, 0.0),
+                                      'integrator_calls': 0, 'rhs_evals': 0, 'jac_evals': 0})
+        with self._lock:
+            runs = list(self.runs)
+        for record in runs:
+            total = plants[record['plant']]
+            total['runs'] += 1
+            for field in ('steps', 'wall', 'integrator_calls', 'rhs_evals', 'jac_evals'):
+                total[field] += record[field]
+            for phase, seconds in record['phases'].items():
+                total['phases'][phase] = total['phases'].get(phase, 0.0) + seconds
+        for total in plants.values():
+            calls = total['integrator_calls']
+            total['rhs_per_call'] = total['rhs_evals'] / calls if calls else 0.0
+            total['seconds_per_step'] = total['wall'] / total['steps'] if total['steps'] else 0.0
+        return {'plants': dict(plants), 'runs': runs}
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"{'plant':<16}{'runs':>6}{'steps':>10}{'wall s':>10}"
+                 + ''.join(f'{phase + " s":>10}' for phase in PHASES) + f"{'rhs/call':>10}"]
+        for name, total in summary['plants'].items():
+            lines.append(f"{name:<16}{total['runs']:>6}{total['steps']:>10}{total['wall']:>10.4f}"
+                         + ''.join(f"{total['phases'][phase]:>10.4f}" for phase in PHASES)
+                         + f"{total['rhs_per_call']:>10.1f}")
+        lines.append('')
+        for n, record in enumerate(summary['runs']):
+            rhs = record['rhs_evals'] / record['integrator_calls'] if record['integrator_calls'] else 0.0
+            lines.append(f"run {n:<4}{record['plant']:<16}{record['steps']:>8} steps {record['wall']:>9.4f} s  "
+                         + '  '.join(f"{phase} {record['phases'][phase]:.4f}" for phase in PHASES)
+                         + f"  rhs/call {rhs:.1f}" + ('' if record['completed'] else '  (aborted)'))
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.runs = []
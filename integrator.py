@@ -0,0 +1,77 @@
+import numpy as np
+from scipy.integrate import odeint, solve_ivp
+
+# SOLVER SETTINGS ------------------------------------------------------------------------------------------------------
+# Every plant gets its solver settings from here: the solve_ivp method, the tolerances and max_step (0 means unbounded).
+# 'LSODA' runs on odeint, any other method goes through solve_ivp. Batch runs always use odeint with the banded
+# Jacobian. Plants and System take overrides, e.g. solver={'method': 'Radau'}. There is one set for all plants: none is
+# stiff over a sample, the fastest mode (the reactor's coolant, eigenvalue about -19) times the default step is of order
+# one, so LSODA stays on Adams, evaluates no Jacobian per sample and beats every other method (see benchmark.py).
+SOLVER_DEFAULTS = {'method': 'LSODA', 'rtol': 1.49012e-8, 'atol': 1.49012e-8, 'max_step': 0.0}
+IVP_METHODS = ('LSODA', 'RK23', 'RK45', 'DOP853', 'Radau', 'BDF')
+JACOBIAN_METHODS = ('LSODA', 'Radau', 'BDF')  # the ones that use plant.jac
+
+
+def solver_settings(**overrides):
+    settings = dict(SOLVER_DEFAULTS, **overrides)
+    if settings['method'] not in IVP_METHODS:
+        raise ValueError(f"Unknown solver method {settings['method']}, expected one of {IVP_METHODS}")
+    return settings
+
+
+def odeint_step(plant, y, t, dt):
+    # one sample of plant.deriv from t to t + dt with the plant's analytic Jacobian and solver settings. With
+    # plant.on_integrate set, odeint's full_output info (nfe, nje, ...) is handed over.
+    solver = plant.solver
+    if solver['method'] != 'LSODA':
+        return ivp_step(plant, y, t, dt).y[:, -1]
+    if plant.on_integrate is None:
+        return odeint(plant.deriv, y, [t, t + dt], Dfun=plant.jac,
+                      rtol=solver['rtol'], atol=solver['atol'], hmax=solver['max_step'])[-1]  # state at t + dt
+    sol, info = odeint(plant.deriv, y, [t, t + dt], Dfun=plant.jac, full_output=True,
+                       rtol=solver['rtol'], atol=solver['atol'], hmax=solver['max_step'])
+    plant.on_integrate(info)
+    return sol[-1]
+
+
+def ivp_step(plant, y, t, dt, first_step=None):
+    # the same sample on solve_ivp, returns its OdeResult. on_integrate gets the evaluation counts under odeint's keys.
+    solver = plant.solver
+    options = {'rtol': solver['rtol'], 'atol': solver['atol'], 'max_step': solver['max_step'] or np.inf}
+    if solver['method'] in JACOBIAN_METHODS and plant.jac is not None:
+        options['jac'] = lambda t, y: plant.jac(y, t)
+    if first_step is not None:
+        options['first_step'] = first_step
+    # plant.deriv is looked up on every call, instrumentation swaps it for a timed wrapper
+    sol = solve_ivp(lambda t, y: plant.deriv(y, t), (t, t + dt), y, method=solver['method'], **options)
+    if not sol.success:
+        raise RuntimeError(f'Integration failed at t = {sol.t[-1]}: {sol.message}')
+    if plant.on_integrate is not None:
+        plant.on_integrate({'nfe': [sol.nfev], 'nje': [sol.njev]})
+    return sol
+
+
+# BATCH INTEGRATION ----------------------------------------------------------------------------------------------------
+# N independent plants are stacked into one (N, n_state) array and flattened row by row, so the Jacobian of the
+# flattened system is block diagonal with (n_state x n_state) blocks. Telling odeint the bandwidth keeps the Jacobian
+# at 2 * n_state - 1 bands no matter how many plants ride along; jac(X, t, u) returns the (N, n, n) blocks.
+def banded(blocks):
+    # odeint's banded layout with ml = mu = n - 1: band[i - j + mu, j] = d f_i / d y_j
+    N, n, _ = blocks.shape
+    a, b = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    band = np.zeros((2 * n - 1, N * n))
+    band[a - b + n - 1, np.arange(N)[:, None, None] * n + b] = blocks
+    return band
+
+
+def odeint_batch(deriv, X, t, dt, u, jac=None, solver=None):
+    N, n = X.shape
+    solver = solver or SOLVER_DEFAULTS
+
+    def flat_deriv(y, t):
+        return np.ravel(deriv(y.reshape(N, n), t, u))
+
+    flat_jac = None if jac is None else lambda y, t: banded(jac(y.reshape(N, n), t, u))
+    y = odeint(flat_deriv, X.ravel(), [t, t + dt], Dfun=flat_jac, ml=n - 1, mu=n - 1,
+               rtol=solver['rtol'], atol=solver['atol'], hmax=solver['max_step'])[-1]  # state at t + dt
+    return y.reshape(N, n)
@@ -0,0 +1,135 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import numpy as np
+from sharedarray import SharedBlock, attach
+import plants
+import system
+
+# MONTE CARLO ROBUSTNESS -----------------------------------------------------------------------------------------------
+# How one tuning holds up against plant uncertainty. Realizations of the plant constants are drawn from declared
+# distributions (the plant's own `uncertainty` unless a spec is given), run in vectorized batches through
+# System.run_batch across a process pool (writing into one shared memory block) and summarized as percentile
+# envelopes of the response plus the spread of the step metrics. A spec maps constant names to a numpy Generator
+# distribution and its arguments:
+#
+#   {'tau': ('normal', 1.0, 0.1), 'zeta': ('uniform', 0.2, 0.3)}
+#
+#   python montecarlo.py "2nd Order ODE" -n 2000 --gains 50 50 30 --plot
+
+DISTRIBUTIONS = ('normal', 'uniform', 'lognormal', 'triangular')
+PERCENTILES = (5, 25, 50, 75, 95)
+METRICS = ('final_error', 'overshoot', 'ise')
+
+_worker_system = None
+
+
+def sample(spec, samples, seed=None):
+    rng = np.random.default_rng(seed)
+    draws = {}
+    for name, (distribution, *args) in spec.items():
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f'Unknown distribution {distribution} for {name}, expected one of {DISTRIBUTIONS}')
+        draws[name] = getattr(rng, distribution)(*args, size=samples)
+    return draws
+
+
+def _init_worker(plant_name, lti, substeps, decimation):
+    global _worker_system
+    _worker_system = system.System(plant_name, lti, substeps=substeps, decimation=decimation)
+
+
+def _run_batch(params, gains, constants, start, spec):
+    size = len(next(iter(constants.values())))
+    y = attach(spec)
+    y[start:start + size] = _worker_system.run_batch(params, np.tile(gains, (size, 1)), constants=constants)[1]
+
+
+def monte_carlo(plant_name, gains=None, setpoint=None, runtime=None, dt=None, samples=1000, spec=None, batch=250,
+                workers=None, percentiles=PERCENTILES, seed=None, lti=False, substeps=1, decimation=1, tolerance=None,
+                keep_runs=False):
+    # tolerance on |final error| for a realization to count as settled, 2% of the setpoint by default
+    nominal = system.System(plant_name, lti, substeps=substeps, decimation=decimation)
+    controls = nominal.plant.controls
+    setpoint = controls['setpoint'] if setpoint is None else setpoint
+    runtime = controls['runtime'] if runtime is None else runtime
+    dt = controls['stepsize'] if dt is None else dt
+    gains = (controls['kpset'], controls['kiset'], controls['kdset']) if gains is None else tuple(gains)
+    tolerance = 0.02 * max(abs(setpoint), 1.0) if tolerance is None else tolerance
+    spec = nominal.plant.uncertainty if spec is None else spec
+    if not spec:
+        raise ValueError(f'No uncertain constants to draw for {plant_name}, pass a spec such as '
+                         f"{{'{next(iter(nominal.plant.constants))}': ('normal', mean, std)}}")
+    unknown = set(spec) - set(nominal.plant.constants)
+    if unknown:
+        raise ValueError(f'Unknown plant constants {sorted(unknown)}, '
+                         f'expected some of {tuple(nominal.plant.constants)}')
+
+    draws = sample(spec, samples, seed)
+    chunks = [{name: values[i:i + batch] for name, values in draws.items()} for i in range(0, samples, batch)]
+    params = (setpoint, runtime, dt)
+    x = np.arange(0, runtime + dt, dt)[::decimation]  # the output grid of System.run_batch
+    with SharedBlock((samples, len(x))) as block:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(plant_name, lti, substeps, decimation)) as executor:
+            list(executor.map(_run_batch, itertools.repeat(params), itertools.repeat(gains), chunks,
+                              range(0, samples, batch), itertools.repeat(block.spec)))
+        y = block.array
+
+    with np.errstate(all='ignore'):
+        table = np.array([system.metrics(x, row, setpoint) for row in y])
+        envelope = np.nanpercentile(y, percentiles, axis=0)
+        spread = {name: dict(zip(percentiles, np.nanpercentile(np.abs(table[:, n]) if name == 'final_error'
+                                                               else table[:, n], percentiles).tolist()))
+                  for n, name in enumerate(METRICS)}
+    result = {'t': x, 'nominal': nominal.run(params + gains)[1], 'percentiles': np.array(percentiles),
+              'envelope': envelope, 'constants': draws, 'metrics': dict(zip(METRICS, table.T)),
+              'summary': {'plant': plant_name, 'gains': gains, 'samples': samples,
+                          'diverged': float(np.mean(~np.isfinite(y[:, -1]))),
+                          'unsettled': float(np.mean(~(np.abs(table[:, 0]) <= tolerance))), **spread}}
+    if keep_runs:
+        result['y'] = y
+    return result
+
+
+def plot_envelope(result, title=''):
+    import matplotlib.pyplot as plt
+    x, envelope, levels = result['t'], result['envelope'], result['percentiles']
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for n in range(len(levels) // 2):
+        ax.fill_between(x, envelope[n], envelope[-n - 1], alpha=0.2 + 0.2 * n, color='tab:blue', linewidth=0,
+                        label=f'{levels[n]:g}-{levels[-n - 1]:g}%')
+    if len(levels) % 2:
+        ax.plot(x, envelope[len(levels) // 2], color='tab:blue', label=f'{levels[len(levels) // 2]:g}%')
+    ax.plot(x, result['nominal'], color='black', linestyle='--', label='nominal')
+    ax.set_title(title or f"{result['summary']['plant']}: {result['summary']['samples']} realizations")
+    ax.set_xlabel('time (s)')
+    ax.legend()
+    ax.grid()
+    plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo robustness of a PID tuning against plant uncertainty.')
+    parser.add_argument('plant', choices=plants.names())
+    parser.add_argument('--gains', type=float, nargs=3, metavar=('KP', 'KI', 'KD'), default=None)
+    parser.add_argument('-n', '--samples', type=int, default=1000)
+    parser.add_argument('-b', '--batch', type=int, default=250, help='realizations per vectorized batch')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--plot', action='store_true')
+    args = parser.parse_args(argv)
+
+    result = monte_carlo(args.plant, args.gains, samples=args.samples, batch=args.batch, workers=args.workers,
+                         seed=args.seed)
+    summary = result['summary']
+    print(f"{summary['plant']} gains {summary['gains']}: {summary['samples']} realizations, "
+          f"{100 * summary['unsettled']:.1f}% unsettled, {100 * summary['diverged']:.1f}% diverged")
+    for name in METRICS:
+        print(f'{name:<12}' + '  '.join(f'p{level:g} {value:.4g}' for level, value in summary[name].items()))
+    if args.plot:
+        plot_envelope(result)
+
+
+if __name__ == "__main__":
+    main()
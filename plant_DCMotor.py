@@ -1,5 +1,6 @@
 import numpy as np
-from scipy.integrate import odeint
+from integrator import odeint_step, odeint_batch, solver_settings
+from datalog import DataLog
 
 # https://towardsdatascience.com/on-simulating-non-linear-dynamic-systems-with-python-or-how-to-gain-insights-without-using-ml-353eebf8dcc3
 # tau * dy2/dt2 + 2*zeta*tau*dy/dt + y = Kp*u
@@ -13,9 +14,13 @@ r = 0.5  # m
 m = 500  # kg
 g = 9.81  # m/s^2
 
+# nominal constants, every Plant holds its own copy and Monte Carlo runs draw around them from UNCERTAINTY
+NOMINAL = {'R': R, 'T_r': T_r, 'L': L, 'k': k, 'r': r, 'm': m, 'g': g}
+UNCERTAINTY = {'R': ('normal', R, 0.1 * R), 'L': ('normal', L, 0.05 * L), 'm': ('uniform', 0.9 * m, 1.1 * m)}
+
 
 # The resistor R will increase its temperature with runtime t
-def R_nonlinear(t):
+def R_nonlinear(t, R=R, T_r=T_r):
     return R + 8 * (1 - np.exp(-t / T_r))
 
 
@@ -24,11 +29,24 @@ def u_t(t):
     return 0
 
 
+NAME = 'DC Motor'  # registry name, see plants.py
+LOG_CHANNELS = ('t', 'x', 'v', 'i')
+
+
 class Plant:
-    def __init__(self):
+    def __init__(self, log_channels=None, solver=None, constants=None):
+        unknown = set(constants or ()) - set(NOMINAL)
+        if unknown:
+            raise ValueError(f'Unknown plant constants {sorted(unknown)}, expected some of {tuple(NOMINAL)}')
+        self.constants = dict(NOMINAL, **(constants or {}))  # this plant's physics, module constants are nominal
+        self.uncertainty = dict(UNCERTAINTY)  # distributions montecarlo draws the constants from
         self.x, self.v, self.i = [0, 0, 0]  # initial condition
-        self.log = []
+        self.log = DataLog(LOG_CHANNELS, log_channels)  # off unless channels are selected
         self.pid = 0
+        self.output_state = 0  # column of the batch state fed back to the controller
+        self.input_sign = 1  # sign of the plant input per unit of pid output
+        self.on_integrate = None  # optional callable receiving odeint's info dict after every step
+        self.solver = solver_settings(**(solver or {}))  # rtol, atol, max_step, method
         self.plot_settings = {'title': 'Elevator position off of ground',
                               'xlabel': 'time (s)', 'ylabel': 'x position away from ground (in)'}
         self.controls = {'setpoint': 10, 'runtime': 100, 'stepsize': 0.05,
@@ -36,26 +54,74 @@ class Plant:
                          'kimin': 0, 'kimax': 1000, 'kistep': 100, 'kiset': 500,
                          'kdmin': 0, 'kdmax': 1000, 'kdstep': 100, 'kdset': 0}
 
+    def parameters(self):
+        return dict(self.constants)
+
     def deriv(self, X, t):
+        c = self.constants
         x, v, i = X
         dxdt = v
-        dvdt = k / (r * m) * i - g
-        didt = (-R_nonlinear(t) / L) * i - (k / r) * v + (1 / L) * self.pid
+        dvdt = c['k'] / (c['r'] * c['m']) * i - c['g']
+        didt = (-R_nonlinear(t, c['R'], c['T_r']) / c['L']) * i - (c['k'] / c['r']) * v + (1 / c['L']) * self.pid
         return [dxdt, dvdt, didt]
 
+    def deriv_batch(self, X, t, u, constants=None):
+        # X is an (N, 3) array of states and u the (N,) accumulated pid input. constants defaults to the plant's own,
+        # its values may be (N,) arrays with one realization per row.
+        c = self.constants if constants is None else constants
+        x, v, i = X.T
+        dxdt = v
+        dvdt = c['k'] / (c['r'] * c['m']) * i - c['g']
+        didt = (-R_nonlinear(t, c['R'], c['T_r']) / c['L']) * i - (c['k'] / c['r']) * v + (1 / c['L']) * u
+        return np.stack((dxdt, dvdt, didt), axis=1)
+
+    def jac(self, X, t):
+        c = self.constants
+        return [[0.0, 1.0, 0.0],
+                [0.0, 0.0, c['k'] / (c['r'] * c['m'])],
+                [0.0, -c['k'] / c['r'], -R_nonlinear(t, c['R'], c['T_r']) / c['L']]]
+
+    def jac_batch(self, X, t, u, constants=None):
+        c = self.constants if constants is None else constants
+        J = np.zeros((len(X), 3, 3))
+        J[:, 0, 1] = 1.0
+        J[:, 1, 2] = c['k'] / (c['r'] * c['m'])
+        J[:, 2, 1] = -c['k'] / c['r']
+        J[:, 2, 2] = -R_nonlinear(t, c['R'], c['T_r']) / c['L']
+        return J
+
     def update(self, pid, t, dt):
         self.pid += pid
         x, v, i = self.x, self.v, self.i
-        self.log.append([t, x, v, i])
-        x, v, i = odeint(self.deriv, [x, v, i], [t, t + dt])[-1]  # start at t, find state at t + dt
+        if self.log.enabled:
+            self.log.append((t, x, v, i))
+        x, v, i = odeint_step(self, [x, v, i], t, dt)  # start at t, find state at t + dt
         self.x, self.v, self.i = x, v, i
 
         return self.x
 
-    def reset(self):
+    def batch_state(self, N, constants=None):
+        return np.zeros((N, 3)), np.zeros(N)
+
+    def update_batch(self, X, u, pid, t, dt, constants=None):
+        u = u + pid
+        if constants is None:
+            X = odeint_batch(self.deriv_batch, X, t, dt, u, self.jac_batch, self.solver)
+        else:
+            X = odeint_batch(lambda X, t, u: self.deriv_batch(X, t, u, constants), X, t, dt, u,
+                             lambda X, t, u: self.jac_batch(X, t, u, constants), self.solver)
+        return X, u
+
+    def reset(self, samples=0):
         self.x, self.v, self.i = [0, 0, 0]  # initial condition
-        self.log = []
+        self.log.allocate(samples)
         self.pid = 0
 
+    def snapshot(self):
+        return self.x, self.v, self.i, self.pid
+
+    def restore(self, state):
+        self.x, self.v, self.i, self.pid = state
+
     def logger(self):
-        return self.log
+        return self.log.view()
@@ -1,6 +1,6 @@
 import numpy as np
-from scipy.integrate import odeint
-import matplotlib.pyplot as plt
+from integrator import odeint_step, odeint_batch, solver_settings
+from datalog import DataLog
 
 # REACTOR PLANT --------------------------------------------------------------------------------------------------------
 # https://jckantor.github.io/CBE30338/04.11-Implementing-PID-Control-in-Nonlinear-Simulations.html
@@ -28,27 +28,33 @@ Vc = 20.0  # Cooling jacket volume
 qc_min = 0  # minimum possible coolant flowrate
 qc_max = 300  # maximum possible coolant flowrate
 
+# nominal constants, every Plant holds its own copy and Monte Carlo runs draw around them from UNCERTAINTY
+NOMINAL = {'Ea': Ea, 'R': R, 'k0': k0, 'V': V, 'rho': rho, 'Cp': Cp, 'dHr': dHr, 'UA': UA, 'q': q, 'Cf': Cf,
+           'Tf': Tf, 'C0': C0, 'T0': T0, 'Tcf': Tcf, 'qc': qc, 'Vc': Vc, 'qc_min': qc_min, 'qc_max': qc_max}
+UNCERTAINTY = {'UA': ('normal', UA, 0.05 * UA), 'Ea': ('normal', Ea, 0.005 * Ea), 'q': ('uniform', 0.95 * q, 1.05 * q)}
+
 
 # Arrhenius rate expression
-def k(T):
+def k(T, k0=k0, Ea=Ea, R=R):
     return k0 * np.exp(-Ea / R / T)
 
 
-def sat(qc):  # function to return feasible value of qc
+def sat(qc, qc_min=qc_min, qc_max=qc_max):  # function to return feasible value of qc
     return max(qc_min, min(qc_max, qc))
 
 
-def plotReactor(X):
-    log = np.asarray(X).T
+def plotReactor(log):
+    # log is the structured array from Plant.logger(), recorded with every channel enabled
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(16, 4))
     plt.subplot(1, 3, 1)
-    plt.plot(log[0], log[1])
+    plt.plot(log['t'], log['C'])
     plt.title('Concentration')
     plt.ylabel('moles/liter')
     plt.xlabel('Time [min]')
 
     plt.subplot(1, 3, 2)
-    plt.plot(log[0], log[2], log[0], log[3])
+    plt.plot(log['t'], log['T'], log['t'], log['Tc'])
     # if 'Tsp' in globals():
     #     plt.plot(plt.xlim(), [Tsp, Tsp], 'r:')
     plt.title('Temperature')
@@ -57,7 +63,7 @@ def plotReactor(X):
     plt.legend(['Reactor', 'Cooling Jacket'])
 
     plt.subplot(1, 3, 3)
-    plt.plot(log[0], log[4])
+    plt.plot(log['t'], log['qc'])
     plt.title('Cooling Water Flowrate')
     plt.ylabel('liters/min')
     plt.xlabel('Time [min]')
@@ -72,11 +78,24 @@ OnInit returned false, exiting...
 """
 
 
+NAME = 'Reactor'  # registry name, see plants.py
+LOG_CHANNELS = ('t', 'C', 'T', 'Tc', 'qc')
+
+
 class Plant:
-    def __init__(self):
-        self.C, self.T, self.Tc = [C0, T0, Tcf]  # initial condition
-        self.qc = qc
-        self.log = []
+    def __init__(self, log_channels=None, solver=None, constants=None):
+        unknown = set(constants or ()) - set(NOMINAL)
+        if unknown:
+            raise ValueError(f'Unknown plant constants {sorted(unknown)}, expected some of {tuple(NOMINAL)}')
+        self.constants = c = dict(NOMINAL, **(constants or {}))  # this plant's physics, module constants are nominal
+        self.uncertainty = dict(UNCERTAINTY)  # distributions montecarlo draws the constants from
+        self.C, self.T, self.Tc = [c['C0'], c['T0'], c['Tcf']]  # initial condition
+        self.qc = c['qc']
+        self.log = DataLog(LOG_CHANNELS, log_channels)  # off unless channels are selected
+        self.output_state = 1  # column of the batch state fed back to the controller
+        self.input_sign = -1  # the pid output is subtracted from the coolant flowrate
+        self.on_integrate = None  # optional callable receiving odeint's info dict after every step
+        self.solver = solver_settings(**(solver or {}))  # rtol, atol, max_step, method
 
         self.plot_settings = {'title': 'Reactor',
                               'xlabel': 'time (s)', 'ylabel': 'Temperature (K)'}
@@ -85,31 +104,92 @@ class Plant:
                          'kimin': 0, 'kimax': 100, 'kistep': 10, 'kiset': 80,
                          'kdmin': 0, 'kdmax': 100, 'kdstep': 10, 'kdset': 0}
 
+    def parameters(self):
+        return dict(self.constants)
+
     def deriv(self, params, t):
+        c = self.constants
+        V, rho, Cp, q, Vc, UA = c['V'], c['rho'], c['Cp'], c['q'], c['Vc'], c['UA']
         C, T, Tc = params
-        dC = (q / V) * (Cf - C) - k(T) * C
-        dT = (q / V) * (Tf - T) + (-dHr / rho / Cp) * k(T) * C + (UA / V / rho / Cp) * (Tc - T)
-        dTc = (self.qc / Vc) * (Tcf - Tc) + (UA / Vc / rho / Cp) * (T - Tc)
+        kT = k(T, c['k0'], c['Ea'], c['R'])
+        dC = (q / V) * (c['Cf'] - C) - kT * C
+        dT = (q / V) * (c['Tf'] - T) + (-c['dHr'] / rho / Cp) * kT * C + (UA / V / rho / Cp) * (Tc - T)
+        dTc = (self.qc / Vc) * (c['Tcf'] - Tc) + (UA / Vc / rho / Cp) * (T - Tc)
         return [dC, dT, dTc]
 
+    def deriv_batch(self, X, t, qc, constants=None):
+        # X is an (N, 3) array of states and qc the (N,) coolant flowrates. constants defaults to the plant's own, its
+        # values may be (N,) arrays with one realization per row.
+        c = self.constants if constants is None else constants
+        V, rho, Cp, q, Vc, UA = c['V'], c['rho'], c['Cp'], c['q'], c['Vc'], c['UA']
+        C, T, Tc = X.T
+        kT = k(T, c['k0'], c['Ea'], c['R'])
+        dC = (q / V) * (c['Cf'] - C) - kT * C
+        dT = (q / V) * (c['Tf'] - T) + (-c['dHr'] / rho / Cp) * kT * C + (UA / V / rho / Cp) * (Tc - T)
+        dTc = (qc / Vc) * (c['Tcf'] - Tc) + (UA / Vc / rho / Cp) * (T - Tc)
+        return np.stack((dC, dT, dTc), axis=1)
+
+    def jac(self, params, t):
+        return self.jac_batch(np.atleast_2d(params), t, self.qc)[0]
+
+    def jac_batch(self, X, t, qc, constants=None):
+        # the Arrhenius term couples temperature and concentration, d k(T) / dT = k(T) * Ea / (R T^2)
+        c = self.constants if constants is None else constants
+        V, rho, Cp, q, Vc, UA, dHr = c['V'], c['rho'], c['Cp'], c['q'], c['Vc'], c['UA'], c['dHr']
+        C, T, Tc = X.T
+        kT = k(T, c['k0'], c['Ea'], c['R'])
+        dkT = kT * c['Ea'] / (c['R'] * T ** 2)
+        J = np.zeros((len(X), 3, 3))
+        J[:, 0, 0] = -q / V - kT
+        J[:, 0, 1] = -dkT * C
+        J[:, 1, 0] = (-dHr / rho / Cp) * kT
+        J[:, 1, 1] = -q / V + (-dHr / rho / Cp) * dkT * C - UA / V / rho / Cp
+        J[:, 1, 2] = UA / V / rho / Cp
+        J[:, 2, 1] = UA / Vc / rho / Cp
+        J[:, 2, 2] = -qc / Vc - UA / Vc / rho / Cp
+        return J
+
     def update(self, pid, t, dt):
         self.qc -= pid
-        self.qc = sat(self.qc)
+        self.qc = sat(self.qc, self.constants['qc_min'], self.constants['qc_max'])
 
         C, T, Tc = self.C, self.T, self.Tc
-        self.log.append([t, C, T, Tc, self.qc])
-        C, T, Tc = odeint(self.deriv, [C, T, Tc], [t, t + dt])[-1]  # start at t, find state at t + dt
+        if self.log.enabled:
+            self.log.append((t, C, T, Tc, self.qc))
+        C, T, Tc = odeint_step(self, [C, T, Tc], t, dt)  # start at t, find state at t + dt
         self.C, self.T, self.Tc = C, T, Tc
 
         return self.T
 
-    def reset(self):
-        self.C, self.T, self.Tc = [C0, T0, Tcf]  # initial condition
-        self.qc = qc
-        self.log = []
+    def batch_state(self, N, constants=None):
+        c = self.constants if constants is None else constants
+        X = np.column_stack(np.broadcast_arrays(c['C0'], c['T0'], c['Tcf'], np.zeros(N)))[:, :3]
+        return X.astype(float), np.broadcast_to(c['qc'], N).astype(float)
+
+    def update_batch(self, X, qc, pid, t, dt, constants=None):
+        c = self.constants if constants is None else constants
+        qc = np.clip(qc - pid, c['qc_min'], c['qc_max'])
+        if constants is None:
+            X = odeint_batch(self.deriv_batch, X, t, dt, qc, self.jac_batch, self.solver)
+        else:
+            X = odeint_batch(lambda X, t, u: self.deriv_batch(X, t, u, constants), X, t, dt, qc,
+                             lambda X, t, u: self.jac_batch(X, t, u, constants), self.solver)
+        return X, qc
+
+    def reset(self, samples=0):
+        c = self.constants
+        self.C, self.T, self.Tc = [c['C0'], c['T0'], c['Tcf']]  # initial condition
+        self.qc = c['qc']
+        self.log.allocate(samples)
+
+    def snapshot(self):
+        return self.C, self.T, self.Tc, self.qc
+
+    def restore(self, state):
+        self.C, self.T, self.Tc, self.qc = state
 
     def logger(self):
-        return self.log
+        return self.log.view()
 
     def plot(self):
         plotReactor(self.logger())
@@ -0,0 +1,91 @@
+import ast
+import glob
+from importlib import import_module
+import os
+import threading
+
+# PLANT REGISTRY -------------------------------------------------------------------------------------------------------
+# Plant names map to 'module:attribute' targets (or the class itself) and a module is only imported the first time one
+# of its plants is built, so a worker process that runs the DC Motor never pays for scipy.signal or the reactor.
+# Besides the built-in plants, names are discovered from
+#
+#   plant_*.py modules next to this one declaring   NAME = 'My Plant'   (read without importing the module)
+#   the 'pid_tuner.plants' entry point group        My Plant = mypackage.plant:Plant
+#
+# or added at runtime with register(). Every target is called as target(**kwargs) and has to return a plant.
+
+ENTRY_POINTS = 'pid_tuner.plants'
+
+_registry = {'Reactor': 'plant_Reactor:Plant',
+             'DC Motor': 'plant_DCMotor:Plant',
+             '2nd Order ODE': 'plant_2ndOrder:Plant'}
+_discovered = False
+_lock = threading.Lock()
+
+
+def register(name, target, replace=False):
+    # target is a 'module:attribute' string (imported lazily) or a callable
+    with _lock:
+        if name in _registry and not replace and _registry[name] != target:
+            raise ValueError(f'Plant {name} is already registered to {_registry[name]}')
+        _registry[name] = target
+    return target
+
+
+def unregister(name):
+    with _lock:
+        _registry.pop(name, None)
+
+
+def _module_name(path):
+    # the NAME a plant module declares, without executing it
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'NAME' for target in node.targets)
+                and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+            return node.value.value
+    return None
+
+
+def discover():
+    global _discovered
+    with _lock:
+        if _discovered:
+            return
+        _discovered = True
+        known = {target for target in _registry.values() if isinstance(target, str)}
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plant_*.py'))):
+            target = f'{os.path.splitext(os.path.basename(path))[0]}:Plant'
+            if target not in known:
+                name = _module_name(path)
+                if name is not None:
+                    _registry.setdefault(name, target)
+        from importlib.metadata import entry_points  # scans the installed distributions, only done once
+        for entry in entry_points(group=ENTRY_POINTS):
+            _registry.setdefault(entry.name, entry.value)
+
+
+def names():
+    discover()
+    with _lock:
+        return tuple(_registry)
+
+
+def plant_class(name):
+    with _lock:
+        target = _registry.get(name)
+    if target is None:
+        discover()  # registered names never pay for the scan
+        with _lock:
+            target = _registry.get(name)
+    if target is None:
+        raise ValueError(f'Unknown plant {name}, expected one of {names()}')
+    if isinstance(target, str):
+        module, _, attribute = target.partition(':')
+        target = getattr(import_module(module), attribute or 'Plant')
+    return target
+
+
+def create(name, **kwargs):
+    return plant_class(name)(**kwargs)
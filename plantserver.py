@@ -0,0 +1,358 @@
+import argparse
+from array import array
+from contextlib import contextmanager
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+from time import perf_counter
+import numpy as np
+from datalog import DataLog
+import plants
+
+# PLANT SERVER ---------------------------------------------------------------------------------------------------------
+# Software in the loop: a plant runs in its own process behind a socket and System drives it step by step, so the
+# controller sees the round trip latency and jitter a real device link adds. Every connection opens its own plant.
+#
+#   python plantserver.py serve --address tcp://127.0.0.1:5555
+#   python plantserver.py bench --plant Loopback --depth 1 8 32
+#   System('Reactor', remote='tcp://127.0.0.1:5555')
+#
+# Addresses are tcp://host:port or unix:///path/to/socket. Frames are a 5 byte header (opcode, payload length) and a
+# little endian payload, a step is 24 bytes out and 8 back:
+#
+#   OPEN      json {plant, constants, solver}      -> json description (controls, constants, output_state, ...)
+#   STEP      pid, t, dt (3 doubles)              -> output (1 double)
+#   HOLD      pid, t, dt (3 doubles), count (u32) -> output after count intervals with the input held
+#   RESET     samples (i64)                       -> empty
+#   SNAPSHOT  empty                               -> plant state (doubles)
+#   RESTORE   plant state (doubles)               -> empty
+#
+# Errors come back as an ERROR frame holding the message. Requests are answered in order, so a client may send
+# several before reading (RemotePlant.pipeline).
+
+OPEN, STEP, HOLD, RESET, SNAPSHOT, RESTORE, ERROR = range(1, 8)
+HEADER = struct.Struct('<BI')
+STEP_FRAME = struct.Struct('<BIddd')
+HOLD_FRAME = struct.Struct('<BIdddI')
+RESET_PAYLOAD = struct.Struct('<q')
+OUTPUT = struct.Struct('<d')
+DESCRIPTION = ('controls', 'plot_settings', 'constants', 'uncertainty', 'output_state', 'input_sign', 'solver')
+HISTOGRAM_BINS = np.logspace(-6, -1, 26)  # 1 us to 100 ms, five bins per decade
+
+
+def parse_address(address):
+    # (family, address) for socket calls
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        host, _, port = address[len('tcp://'):].rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError(f'Unknown plant server address {address}, expected tcp://host:port or unix:///path')
+
+
+def _floats(payload):
+    return array('d', payload).tolist()
+
+
+class LoopbackPlant:
+    # the stand-in for benchmarking the transport: no physics, the output is the accumulated input
+    def __init__(self, log_channels=None, constants=None):
+        self.constants = dict(constants or {})
+        self.uncertainty = {}
+        self.output_state = 0
+        self.input_sign = 1
+        self.u = 0.0
+        self.plot_settings = {'title': 'Loopback', 'xlabel': 'time (s)', 'ylabel': 'accumulated input'}
+        self.controls = {'setpoint': 10, 'runtime': 30, 'stepsize': 0.05,
+                         'kpmin': 0, 'kpmax': 10, 'kpstep': 1, 'kpset': 0,
+                         'kimin': 0, 'kimax': 10, 'kistep': 1, 'kiset': 1,
+                         'kdmin': 0, 'kdmax': 10, 'kdstep': 1, 'kdset': 0}
+
+    def parameters(self):
+        return dict(self.constants)
+
+    def update(self, pid, t, dt):
+        self.u += pid
+        return self.u
+
+    def reset(self, samples=0):
+        self.u = 0.0
+
+    def snapshot(self):
+        return self.u,
+
+    def restore(self, state):
+        self.u, = state
+
+
+def open_plant(name, constants=None, solver=None):
+    if name == 'Loopback':
+        return LoopbackPlant(constants=constants)
+    return plants.create(name, constants=constants, **({'solver': solver} if solver else {}))
+
+
+# SERVER ---------------------------------------------------------------------------------------------------------------
+class PlantHandler(socketserver.StreamRequestHandler):
+    # one connection, one plant
+    def setup(self):
+        super().setup()
+        if self.server.address_family == socket.AF_INET:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        read, write = self.rfile.read, self.wfile.write
+        plant = None
+        while True:
+            header = read(HEADER.size)
+            if len(header) < HEADER.size:
+                return  # client went away
+            op, size = HEADER.unpack(header)
+            payload = read(size)
+            try:
+                if op == STEP:
+                    reply = OUTPUT.pack(plant.update(*struct.unpack('<ddd', payload)))
+                elif op == HOLD:
+                    pid, t, dt, count = struct.unpack('<dddI', payload)
+                    output = plant.update(pid, t, dt)
+                    for k in range(1, count):
+                        output = plant.update(0, t + k * dt, dt)  # input held, as System's substeps
+                    reply = OUTPUT.pack(output)
+                elif op == RESET:
+                    samples, = RESET_PAYLOAD.unpack(payload)
+                    plant.reset(samples)
+                    reply = b''
+                elif op == SNAPSHOT:
+                    reply = array('d', plant.snapshot()).tobytes()
+                elif op == RESTORE:
+                    plant.restore(tuple(_floats(payload)))
+                    reply = b''
+                elif op == OPEN:
+                    request = json.loads(payload)
+                    plant = open_plant(request['plant'], request.get('constants'), request.get('solver'))
+                    reply = json.dumps({name: getattr(plant, name, None) for name in DESCRIPTION}).encode()
+                else:
+                    raise ValueError(f'Unknown opcode {op}')
+            except Exception as error:
+                op, reply = ERROR, f'{type(error).__name__}: {error}'.encode()
+            write(HEADER.pack(op, len(reply)) + reply)
+            self.wfile.flush()
+
+
+class TCPPlantServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixPlantServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address):
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.unlink(target)  # stale socket of an earlier server
+        return UnixPlantServer(target, PlantHandler)
+    return TCPPlantServer(target, PlantHandler)
+
+
+def serve(address, ready=None):
+    with make_server(address) as server:
+        if ready is not None:
+            ready.put(server.server_address)  # the actual port when asked for port 0
+        server.serve_forever()
+
+
+@contextmanager
+def loopback(address=None):
+    # a plant server in a child process for the lifetime of the with block, yields its address. Defaults to a unix
+    # socket in a temporary directory; tcp://127.0.0.1:0 picks a free port.
+    with tempfile.TemporaryDirectory() as directory:
+        address = address or f'unix://{os.path.join(directory, "plant.sock")}'
+        ready = multiprocessing.Queue()
+        process = multiprocessing.Process(target=serve, args=(address, ready), daemon=True)
+        process.start()
+        try:
+            bound = ready.get(timeout=10)
+            if address.startswith('tcp://'):
+                address = f'tcp://{bound[0]}:{bound[1]}'
+            yield address
+        finally:
+            process.terminate()
+            process.join()
+
+
+# CLIENT ---------------------------------------------------------------------------------------------------------------
+class RemotePlant:
+    # the plant interface System.run and System.stream use (update, reset, snapshot, restore) over a plant server
+    # connection. Every round trip is timed into self.latency (seconds). Batch runs, the LTI path and loop analysis
+    # need the plant's model and stay local.
+    def __init__(self, address, name, log_channels=None, solver=None, constants=None):
+        if log_channels:
+            raise ValueError('Remote plants have no log, run the plant locally to record its channels')
+        family, target = parse_address(address)
+        self.address, self.name = address, name
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(target)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.latency = array('d')
+        self.log = DataLog(())  # disabled, System checks log.enabled
+        self.on_integrate = None
+        description = json.loads(self.request(OPEN, json.dumps({'plant': name, 'constants': constants,
+                                                                'solver': solver}).encode()))
+        for attribute, value in description.items():
+            setattr(self, attribute, value)
+
+    def parameters(self):
+        return dict(self.constants)
+
+    def request(self, op, payload=b''):
+        start = perf_counter()
+        self.sock.sendall(HEADER.pack(op, len(payload)) + payload)
+        reply = self.receive()
+        self.latency.append(perf_counter() - start)
+        return reply
+
+    def receive(self):
+        header = self.rfile.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError(f'Plant server at {self.address} closed the connection')
+        op, size = HEADER.unpack(header)
+        payload = self.rfile.read(size)
+        if op == ERROR:
+            raise RuntimeError(f'Plant server at {self.address}: {payload.decode()}')
+        return payload
+
+    def update(self, pid, t, dt):
+        start = perf_counter()
+        self.sock.sendall(STEP_FRAME.pack(STEP, 24, pid, t, dt))
+        output, = OUTPUT.unpack(self.receive())
+        self.latency.append(perf_counter() - start)
+        return output
+
+    def advance(self, pid, t, dt, count):
+        # update(pid, t, dt) followed by count - 1 held intervals in one round trip, System's substeps
+        start = perf_counter()
+        self.sock.sendall(HOLD_FRAME.pack(HOLD, 28, pid, t, dt, count))
+        output, = OUTPUT.unpack(self.receive())
+        self.latency.append(perf_counter() - start)
+        return output
+
+    def pipeline(self, pid, t, dt, depth=8):
+        # open loop: steps with the inputs known up front, keeping up to depth requests in flight. Returns the outputs
+        # and records each step's time from send to reply, which includes the queueing in front of it.
+        pid, t = np.broadcast_arrays(np.asarray(pid, dtype=float), np.asarray(t, dtype=float))
+        output = np.empty(len(pid))
+        sent = np.empty(len(pid))
+        received = 0
+        for n in range(len(pid)):
+            if n - received == depth:
+                output[received], = OUTPUT.unpack(self.receive())
+                self.latency.append(perf_counter() - sent[received])
+                received += 1
+            sent[n] = perf_counter()
+            self.sock.sendall(STEP_FRAME.pack(STEP, 24, pid[n], t[n], dt))
+        for n in range(received, len(pid)):
+            output[n], = OUTPUT.unpack(self.receive())
+            self.latency.append(perf_counter() - sent[n])
+        return output
+
+    def reset(self, samples=0):
+        self.request(RESET, RESET_PAYLOAD.pack(samples))
+
+    def snapshot(self):
+        return tuple(_floats(self.request(SNAPSHOT)))
+
+    def restore(self, state):
+        self.request(RESTORE, array('d', state).tobytes())
+
+    def logger(self):
+        return self.log.view()
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+# LATENCY --------------------------------------------------------------------------------------------------------------
+def latency_report(latency, bins=HISTOGRAM_BINS):
+    # round trip statistics (seconds) and the loop rate they allow, one controller step per round trip
+    latency = np.asarray(latency)
+    counts, edges = np.histogram(np.clip(latency, bins[0], bins[-1]), bins)
+    mean = float(latency.mean())
+    return {'count': len(latency), 'mean': mean, 'std': float(latency.std()), 'min': float(latency.min()),
+            'p50': float(np.percentile(latency, 50)), 'p90': float(np.percentile(latency, 90)),
+            'p99': float(np.percentile(latency, 99)), 'max': float(latency.max()), 'loop_hz': 1 / mean,
+            'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()}}
+
+
+def format_histogram(report, width=50):
+    counts, edges = report['histogram']['counts'], report['histogram']['edges']
+    used = [n for n, count in enumerate(counts) if count]
+    top = max(counts)
+    lines = []
+    for n in range(used[0], used[-1] + 1):
+        lines.append(f"{1e6 * edges[n]:>9.1f} us {'#' * round(width * counts[n] / top):<{width}} {counts[n]}")
+    return '\n'.join(lines)
+
+
+def bench(address, plant='Loopback', steps=10000, depths=(1, 8, 32)):
+    # closed loop rate (one step per round trip, what System achieves) and pipelined throughput per depth
+    remote = RemotePlant(address, plant)
+    results = []
+    try:
+        remote.reset(steps)
+        for n in range(min(1000, steps // 10)):
+            remote.update(0.0, 0.0, 0.05)  # warm up
+        for depth in depths:
+            remote.reset(steps)
+            del remote.latency[:]
+            start = perf_counter()
+            if depth == 1:
+                for n in range(steps):
+                    remote.update(0.0, n * 0.05, 0.05)
+            else:
+                remote.pipeline(0.0, np.arange(steps) * 0.05, 0.05, depth)
+            seconds = perf_counter() - start
+            results.append({'depth': depth, 'steps': steps, 'seconds': seconds, 'steps_per_second': steps / seconds,
+                            **latency_report(remote.latency)})
+    finally:
+        remote.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve plants over a socket, or benchmark the loop through one.')
+    parser.add_argument('mode', choices=('serve', 'bench'))
+    parser.add_argument('--address', default=None,
+                        help='tcp://host:port or unix:///path, bench starts its own server there')
+    parser.add_argument('--plant', default='Loopback', help='plant to benchmark')
+    parser.add_argument('--steps', type=int, default=10000)
+    parser.add_argument('--depth', type=int, nargs='+', default=[1, 8, 32], help='requests in flight')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'serve':
+        print(f'serving plants on {args.address or "tcp://127.0.0.1:5555"}')
+        serve(args.address or 'tcp://127.0.0.1:5555')
+        return
+
+    with loopback(args.address) as address:
+        results = bench(address, args.plant, args.steps, args.depth)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(f"{args.plant} depth {result['depth']}: {result['steps_per_second']:.0f} steps/s, round trip "
+              f"p50 {1e6 * result['p50']:.1f} us  p99 {1e6 * result['p99']:.1f} us  max {1e6 * result['max']:.1f} us")
+        print(format_histogram(result))
+
+
+if __name__ == "__main__":
+    main()
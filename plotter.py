@@ -0,0 +1,282 @@
+from collections import deque
+import numpy as np
+from matplotlib.collections import LineCollection
+
+
+# LEVEL OF DETAIL ------------------------------------------------------------------------------------------------------
+# A line never needs more than a couple of vertices per pixel column. minmax_decimate keeps the smallest and largest
+# sample of every bucket (in time order), so peaks and overshoot survive and the drawn size only depends on the axes
+# width. NaN samples (terminated runs) are skipped inside a bucket unless the whole bucket is NaN.
+def minmax_decimate(x, y, buckets):
+    n = len(x)
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)
+    full = n // size * size  # whole buckets are a reshaped view, the remainder is one more (shorter) bucket
+    picks = [bucket_extremes(y[:full].reshape(-1, size)) + np.arange(0, full, size)[:, None]]
+    if full < n:
+        picks.append(bucket_extremes(y[full:].reshape(1, -1)) + full)
+    keep = np.unique(np.concatenate([[0]] + [p.ravel() for p in picks] + [[n - 1]]))
+    return x[keep], y[keep]
+
+
+def bucket_extremes(rows):
+    # column of the min and max of every row, in order
+    if np.isnan(rows).any():
+        lo = np.argmin(np.where(np.isnan(rows), np.inf, rows), axis=1)
+        hi = np.argmax(np.where(np.isnan(rows), -np.inf, rows), axis=1)
+    else:
+        lo, hi = np.argmin(rows, axis=1), np.argmax(rows, axis=1)
+    return np.stack((np.minimum(lo, hi), np.maximum(lo, hi)), axis=1)
+
+
+def minmax_decimate_rows(x, Y, buckets):
+    # minmax_decimate for a (runs, n) stack sharing x. Every row keeps the same number of columns (first, min and max of
+    # every bucket, last; repeated columns are harmless), so the result is one pair of (runs, m) arrays.
+    runs, n = Y.shape
+    if n <= 2 * buckets:
+        return np.broadcast_to(x, Y.shape), Y
+    size = -(-n // buckets)
+    full = n // size * size
+    picks = [bucket_extremes(Y[:, :full].reshape(-1, size)).reshape(runs, -1) + np.repeat(np.arange(0, full, size), 2)]
+    if full < n:
+        picks.append(bucket_extremes(Y[:, full:]) + full)
+    columns = np.concatenate([np.zeros((runs, 1), dtype=int)] + picks + [np.full((runs, 1), n - 1)], axis=1)
+    return x[columns], np.take_along_axis(Y, columns, axis=1)
+
+
+class LODLine:
+    # Keeps the full resolution data of a Line2D and hands it only the decimated part inside the current x limits,
+    # about `factor` points per pixel. Zooming or panning with the toolbar (xlim_changed) and resizing decimate again
+    # from the full data.
+    def __init__(self, line, factor=2):
+        self.line = line
+        self.ax = line.axes
+        self.factor = factor
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.refresh())
+        self.ax.figure.canvas.mpl_connect('resize_event', lambda event: self.refresh())
+
+    def set_data(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.refresh()
+
+    def refresh(self):
+        lo, hi = sorted(self.ax.get_xlim())
+        start = max(np.searchsorted(self.x, lo) - 1, 0)  # one sample beyond each edge keeps the line running off axes
+        stop = min(np.searchsorted(self.x, hi, side='right') + 1, len(self.x))
+        buckets = max(int(self.ax.bbox.width * self.factor) // 2, 1)  # min and max make two points per bucket
+        self.line.set_data(*minmax_decimate(self.x[start:stop], self.y[start:stop], buckets))
+
+
+class TraceBuffer:
+    # Append-only (x, y) history of a streamed run that never holds more than `capacity` points. When it fills up, what
+    # it holds is min/max decimated to half of that, so an open-ended run keeps its peaks in bounded memory and every
+    # append costs amortized O(1). Older parts of the trace end up coarser than the latest ones.
+    def __init__(self, capacity=1 << 14):
+        self.x = np.empty(max(int(capacity), 8))
+        self.y = np.empty(len(self.x))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        capacity = len(self.x)
+        while len(x):
+            if self.size == capacity:
+                kept_x, kept_y = minmax_decimate(self.x, self.y, capacity // 4)
+                self.size = len(kept_x)
+                self.x[:self.size], self.y[:self.size] = kept_x, kept_y
+            take = min(len(x), capacity - self.size)
+            self.x[self.size:self.size + take] = x[:take]
+            self.y[self.size:self.size + take] = y[:take]
+            self.size += take
+            x, y = x[take:], y[take:]
+
+    def data(self):
+        # views, valid until the next extend
+        return self.x[:self.size], self.y[:self.size]
+
+
+# GHOST TRACES ---------------------------------------------------------------------------------------------------------
+class GhostOverlay:
+    # Earlier responses drawn faintly behind the live line as a single LineCollection, a hundred ghosts cost one artist
+    # per redraw. The last `capacity` runs are kept at full resolution next to their decimated segments: add only
+    # decimates the rows it is given, zooming or resizing decimates everything again (runs added together in one
+    # stack are redone in one vectorized call).
+    def __init__(self, ax, capacity=20, factor=2, color='0.5', alpha=0.3, linewidth=1.0):
+        self.ax = ax
+        self.factor = factor
+        self.runs = deque(maxlen=capacity)  # (x, y) at full resolution, rows of one stack share x
+        self.segments = deque(maxlen=capacity)  # (m, 2) vertices per run as drawn
+        self.collection = LineCollection([], colors=color, alpha=alpha, linewidths=linewidth, zorder=1.5)
+        ax.add_collection(self.collection, autolim=False)  # below the lines (zorder 2), limits follow the live run
+        ax.callbacks.connect('xlim_changed', lambda ax: self.refresh())
+        ax.figure.canvas.mpl_connect('resize_event', lambda event: self.refresh())
+
+    def __len__(self):
+        return len(self.runs)
+
+    def add(self, x, Y):
+        # one run (Y of shape (n,)) or a stack of runs sharing x (shape (runs, n)), the oldest ghosts drop out
+        x = np.asarray(x, dtype=float)
+        Y = np.atleast_2d(np.asarray(Y, dtype=float))
+        self.runs.extend((x, y) for y in Y)
+        self.segments.extend(self._decimate(x, Y))
+        self.collection.set_segments(list(self.segments))
+
+    def clear(self, capacity=None):
+        # capacity resizes the overlay, e.g. to hold a whole sweep
+        capacity = self.runs.maxlen if capacity is None else capacity
+        self.runs = deque(maxlen=capacity)
+        self.segments = deque(maxlen=capacity)
+        self.collection.set_segments([])
+
+    def refresh(self):
+        segments = []
+        start = 0
+        runs = list(self.runs)
+        for n in range(1, len(runs) + 1):
+            if n == len(runs) or runs[n][0] is not runs[start][0]:
+                segments.extend(self._decimate(runs[start][0], np.array([y for x, y in runs[start:n]])))
+                start = n
+        self.segments.clear()
+        self.segments.extend(segments)
+        self.collection.set_segments(segments)
+
+    def _decimate(self, x, Y):
+        lo, hi = sorted(self.ax.get_xlim())
+        start = max(np.searchsorted(x, lo) - 1, 0)
+        stop = min(np.searchsorted(x, hi, side='right') + 1, len(x))
+        buckets = max(int(self.ax.bbox.width * self.factor) // 2, 1)
+        X, Y = minmax_decimate_rows(x[start:stop], Y[:, start:stop], buckets)
+        return list(np.stack((X, Y), axis=2))
+
+
+# BLITTING -------------------------------------------------------------------------------------------------------------
+class BlitPlotter:
+    # Redraws only the data artists of one axes on top of a cached background (axes, grid, labels). The expensive
+    # full draw with tight_layout happens only when the data leaves the current limits, shrinks to less than
+    # `hysteresis` of the y span, or something else (resize, toolbar, label change) redrew the figure. Plotters of
+    # other axes on the same canvas have to be linked, a full draw of one then refreshes every background at once.
+    # Static artists (ghost traces) change far less often than the data, they are composed into the background once
+    # per invalidate_static instead of being redrawn on every blit. Once the toolbar zooms or pans away from the limits
+    # set here, the view is the user's and stays put until autoscale() (or the toolbar's Home) brings it back.
+    def __init__(self, figure, canvas, ax, artists, margin=0.1, hysteresis=0.5, static=()):
+        self.figure = figure
+        self.canvas = canvas
+        self.ax = ax
+        self.artists = list(artists)
+        self.static = list(static)
+        self.margin = margin
+        self.hysteresis = hysteresis
+
+        self.base = None  # the axes without any artists
+        self.background = None  # base with the static artists on top
+        self._static_stale = False
+        self._drawing = False
+        self._auto = None  # (xlim, ylim) of the last automatic limits
+        self.group = [self]  # linked plotters, this one included
+        canvas.mpl_connect('draw_event', self._on_draw)
+        canvas.mpl_connect('resize_event', lambda event: self.invalidate())
+
+    def invalidate(self):
+        self.background = None
+
+    def invalidate_static(self):
+        self._static_stale = True  # recomposed on the next draw
+
+    def zoomed(self):
+        return self._auto is not None and (self.ax.get_xlim(), self.ax.get_ylim()) != self._auto
+
+    def autoscale(self):
+        self._auto = None  # the next draw fits the limits to the data again
+
+    def link(self, other):
+        group = self.group + [plotter for plotter in other.group if plotter not in self.group]
+        for plotter in group:
+            plotter.group = group
+
+    def draw(self, x, y):
+        # returns True when the limits were moved to the data, which needed a full layout pass
+        if self.zoomed():
+            if self.background is None:
+                self._full_draw(self.ax.get_xlim(), self.ax.get_ylim())
+                return False
+        else:
+            xlim, ylim = self._bounds(x, y)
+            if self.background is None or xlim != self.ax.get_xlim() or not self._inside(ylim, self.ax.get_ylim()):
+                self._full_draw(xlim, self._pad(ylim))
+                self._auto = (self.ax.get_xlim(), self.ax.get_ylim())
+                return True
+        if self._static_stale:
+            self._compose()
+        self._blit()
+        return False
+
+    def _bounds(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        y = y[np.isfinite(y)]
+        if not len(x) or not len(y):
+            return self.ax.get_xlim(), self.ax.get_ylim()
+        xlim = (x[0], x[-1]) if x[-1] > x[0] else (x[0] - 0.5, x[0] + 0.5)
+        return tuple(float(v) for v in xlim), (float(y.min()), float(y.max()))
+
+    def _inside(self, ylim, current):
+        lo, hi = ylim
+        bottom, top = current
+        return bottom <= lo and hi <= top and (hi - lo) >= self.hysteresis * (top - bottom)
+
+    def _pad(self, ylim):
+        lo, hi = ylim
+        pad = (hi - lo) * self.margin or max(abs(lo), 1.0) * self.margin
+        return lo - pad, hi + pad
+
+    def _full_draw(self, xlim, ylim):
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.figure.tight_layout()
+
+        # capture the backgrounds without the data artists, then put them back on top
+        artists = [artist for plotter in self.group for artist in plotter.artists + plotter.static]
+        for artist in artists:
+            artist.set_visible(False)
+        for plotter in self.group:
+            plotter._drawing = True
+        try:
+            self.canvas.draw()
+        finally:
+            for plotter in self.group:
+                plotter._drawing = False
+            for artist in artists:
+                artist.set_visible(True)
+        for plotter in self.group:
+            plotter.base = self.canvas.copy_from_bbox(plotter.ax.bbox)
+            plotter._compose()
+            plotter._blit()
+
+    def _compose(self):
+        self._static_stale = False
+        if not self.static:
+            self.background = self.base
+            return
+        self.canvas.restore_region(self.base)
+        for artist in self.static:
+            self.ax.draw_artist(artist)
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    def _blit(self):
+        self.canvas.restore_region(self.background)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+        self.canvas.flush_events()
+
+    def _on_draw(self, event):
+        if not self._drawing:
+            self.background = None  # redrawn by someone else, the cached background may be stale or contain data
@@ -0,0 +1,120 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import re
+import numpy as np
+import system
+from termination import Termination
+from trajstore import TrajectoryStore
+
+# HEADLESS SCENARIO RUNNER ---------------------------------------------------------------------------------------------
+# Runs every gain set of every scenario in a JSON file across a process pool and writes one .npz per task plus a
+# manifest.json, no plotting and no wx. A scenario file looks like:
+#
+#   {"scenarios": [{"name": "reactor", "plant": "Reactor", "setpoint": 390, "runtime": 30, "dt": 0.05,
+#                   "gains": [[40, 80, 0], [10, 20, 0]]}]}
+#
+# setpoint, runtime and dt default to the plant's own controls, "lti": true selects the linear fast path and
+# "termination": {"max_abs": 1e4, "tolerance": 0.05, "hold": 2} stops runs early (see termination.Termination).
+# dt is the controller period; "substeps" integrates the plant in that many intervals per period and "decimation"
+# keeps every n-th controller step in the output, which keeps long runtimes small on disk.
+
+_systems = {}  # per worker process: (plant name, lti, substeps, decimation, store path) -> System
+
+
+def load_scenarios(path):
+    with open(path) as f:
+        spec = json.load(f)
+    scenarios = spec['scenarios'] if isinstance(spec, dict) else spec
+
+    stems = {}
+    for n, scenario in enumerate(scenarios):
+        controls = system.get_plant(scenario['plant']).controls
+        scenario.setdefault('name', f'scenario_{n}')
+        scenario.setdefault('setpoint', controls['setpoint'])
+        scenario.setdefault('runtime', controls['runtime'])
+        scenario.setdefault('dt', controls['stepsize'])
+        scenario.setdefault('gains', [[controls['kpset'], controls['kiset'], controls['kdset']]])
+        scenario.setdefault('lti', False)
+        scenario.setdefault('termination', None)
+        scenario.setdefault('substeps', 1)
+        scenario.setdefault('decimation', 1)
+        if np.shape(scenario['gains'])[-1] != 3:
+            raise ValueError(f"Scenario {scenario['name']}: gains must be a list of [Kp, Ki, Kd]")
+        stem = file_stem(scenario['name']).lower()  # names only differing in case clash on some file systems
+        if stem in stems:
+            raise ValueError(f"Scenarios {stems[stem]} and {scenario['name']} would write the same files, rename one")
+        stems[stem] = scenario['name']
+    return scenarios
+
+
+def file_stem(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+def _run_task(scenario, chunk, gains, output_dir, store=None):
+    key = (scenario['plant'], scenario['lti'], scenario['substeps'], scenario['decimation'], store)
+    if key not in _systems:
+        archive = None if store is None else TrajectoryStore(store)
+        _systems[key] = system.System(key[0], key[1], substeps=key[2], decimation=key[3], archive=archive)
+    sim = _systems[key]
+    sim.termination = None if scenario['termination'] is None else Termination(**scenario['termination'])
+    if sim.termination is not None and sim.termination.pad == 'truncate':
+        raise ValueError(f"Scenario {scenario['name']}: truncated runs cannot be stacked, use pad 'hold' or 'nan'")
+
+    setpoint, runtime, dt = scenario['setpoint'], scenario['runtime'], scenario['dt']
+    runs, rows = [], []
+    for Kp, Ki, Kd in gains:
+        x, y = sim.run((setpoint, runtime, dt, Kp, Ki, Kd))
+        runs.append(y)
+        rows.append(system.sweep_row(sim, (Kp, Ki, Kd), x, y, setpoint))
+    y = np.array(runs)
+    table = np.array(rows, dtype=system.SWEEP_DTYPE)
+
+    filename = f"{file_stem(scenario['name'])}_{chunk:04d}.npz"
+    np.savez(os.path.join(output_dir, filename), t=x, y=y, gains=np.asarray(gains, dtype=float), metrics=table)
+    return {'scenario': scenario['name'], 'plant': scenario['plant'], 'file': filename, 'chunk': chunk,
+            'setpoint': setpoint, 'runtime': runtime, 'dt': dt, 'lti': scenario['lti'],
+            'substeps': scenario['substeps'], 'decimation': scenario['decimation'],
+            'shape': list(y.shape), 'gains': [list(map(float, g)) for g in gains],
+            'metrics': {name: table[name].tolist() for name in table.dtype.names[3:]}}
+
+
+def run_scenarios(scenarios, output_dir, workers=None, chunksize=16, verbose=True, store=None):
+    # store is the path of a trajstore.TrajectoryStore consulted before every run and appended to
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(scenario, i // chunksize, scenario['gains'][i:i + chunksize])
+             for scenario in scenarios for i in range(0, len(scenario['gains']), chunksize)]
+
+    manifest = []
+    with ProcessPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_run_task, *task, output_dir, store) for task in tasks]
+        for future in as_completed(futures):
+            entry = future.result()
+            manifest.append(entry)
+            if verbose:
+                print(f"[{len(manifest)}/{len(tasks)}] {entry['scenario']} -> {entry['file']}", flush=True)
+
+    manifest.sort(key=lambda entry: (entry['scenario'], entry['chunk']))
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump({'runs': manifest}, f, indent=1)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run PID scenario files headless and in parallel.')
+    parser.add_argument('scenario_file', help='JSON file with a list of scenarios')
+    parser.add_argument('-o', '--output', default='results', help='directory for the .npz files and manifest.json')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('-c', '--chunksize', type=int, default=16, help='gain sets per task / output file')
+    parser.add_argument('-s', '--store', default=None, help='trajectory store directory, reused runs are not simulated')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    scenarios = load_scenarios(args.scenario_file)
+    run_scenarios(scenarios, args.output, args.workers, args.chunksize, verbose=not args.quiet, store=args.store)
+
+
+if __name__ == "__main__":
+    main()
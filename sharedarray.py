@@ -0,0 +1,56 @@
+import ctypes
+from multiprocessing import shared_memory
+import numpy as np
+
+# SHARED MEMORY TRANSPORT ----------------------------------------------------------------------------------------------
+# Trajectories computed in worker processes are written straight into one preallocated (runs, samples) block of shared
+# memory instead of being pickled back through the pool's pipes. The parent allocates a SharedBlock and hands the
+# workers its spec (name, shape, dtype); both sides wrap the segment as a numpy array without copying. The name is
+# unlinked when the block is closed (end of its with statement), the mapping itself stays valid for exactly as long as
+# an array wrapping it is alive.
+
+
+class _Mapping:
+    # array base keeping the segment mapped. numpy only gets the raw address, so there is no buffer export that would
+    # stop SharedMemory from closing once the last array is gone.
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        probe = ctypes.c_char.from_buffer(shm.buf)
+        address = ctypes.addressof(probe)
+        del probe
+        self.__array_interface__ = {'version': 3, 'shape': shape, 'typestr': dtype.str, 'data': (address, False)}
+
+
+def _wrap(shm, shape, dtype):
+    return np.asarray(_Mapping(shm, tuple(shape), np.dtype(dtype)))
+
+
+class SharedBlock:
+    def __init__(self, shape, dtype=float, fill=np.nan):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.spec = (self.shm.name, self.shape, self.dtype.str)  # picklable handle for attach()
+        self.array = _wrap(self.shm, self.shape, self.dtype)
+        if fill is not None:
+            self.array.fill(fill)
+
+    def close(self):
+        # removes the name only, self.array (and anything sliced from it) keeps working
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    # the parent's block inside a worker, writes show up in the parent's array
+    name, shape, dtype = spec
+    return _wrap(shared_memory.SharedMemory(name=name), shape, dtype)
@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+from plotter import TraceBuffer
+
+
+class SimulationWorker(threading.Thread):
+    # Runs System.run off the GUI thread. Only one request is ever pending: a new submit replaces it and aborts the
+    # run in flight, so dragging a slider never queues up stale gains. on_result(generation, (x, y)) is called from
+    # this thread; the GUI wraps it in wx.CallAfter. With on_chunk(generation, t, y) runs are streamed (System.stream)
+    # and every chunk is handed over as soon as it is computed, on_result still gets the whole trajectory at the end.
+    # An open-ended run (runtime None) has none, on_result gets a bounded, decimated history of it instead.
+    def __init__(self, on_result, on_chunk=None, chunk=64, pace=None):
+        super().__init__(daemon=True)
+        self.on_result = on_result
+        self.on_chunk = on_chunk
+        self.chunk = chunk
+        self.pace = pace  # wall clock playback speed for streamed runs, None runs flat out
+        self.generation = 0
+        self._pending = None
+        self._stopped = False
+        self._cond = threading.Condition()
+        self.start()
+
+    def submit(self, system, params):
+        with self._cond:
+            self.generation += 1
+            self._pending = (self.generation, system, params)
+            self._cond.notify()
+            return self.generation
+
+    def cancel(self):
+        with self._cond:
+            self.generation += 1  # aborts the run in flight
+            self._pending = None
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._pending = None
+            self._cond.notify()
+
+    def is_current(self, generation):
+        return generation == self.generation and not self._stopped
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                generation, system, params = self._pending
+                self._pending = None
+
+            if self.on_chunk is None:
+                result = system.run(params, abort=lambda: not self.is_current(generation))
+            else:
+                result = self._stream(generation, system, params)
+            if result is not None and self.is_current(generation):
+                self.on_result(generation, result)
+
+    def _stream(self, generation, system, params):
+        runtime = params[1]
+        history = TraceBuffer() if runtime is None or not np.isfinite(runtime) else None
+        stream = system.stream(params, self.chunk, self.pace)
+        try:
+            while True:
+                t, y = next(stream)
+                if not self.is_current(generation):
+                    return None  # closing the stream keeps what was computed for the next run's checkpoints
+                self.on_chunk(generation, t, y)
+                if history is not None:
+                    history.extend(t, y)
+        except StopIteration as stop:
+            return stop.value if history is None else history.data()
+        finally:
+            stream.close()
@@ -1,48 +1,435 @@
-from PID import PID
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+from time import perf_counter, sleep
+from PID import PID, PIDBank
+from sharedarray import SharedBlock, attach
+from termination import REASONS
 import numpy as np
-import matplotlib.pyplot as plt
-from plant_Reactor import Plant as Reactor
-from plant_DCMotor import Plant as DCMotor
-from plant_2ndOrder import Plant as SecOrder
+import plants
+import tuner
 
 
 class System:
-    def __init__(self, plant_name):
-        self.plant = get_plant(plant_name)
+    def __init__(self, plant_name, lti=False, log_channels=None, cache=None, checkpoint_every=100,
+                 instrumentation=None, termination=None, substeps=1, decimation=1, constants=None,
+                 remote=None, archive=None, solver=None):
+        self.plant_name = plant_name
+        if remote is None:
+            # solver overrides the plant's integration settings, see integrator.SOLVER_DEFAULTS
+            self.plant = get_plant(plant_name, log_channels=log_channels, constants=constants,
+                                   **({'solver': solver} if solver else {}))
+        else:
+            # software in the loop, the plant steps in a plant server process, see plantserver.py
+            from plantserver import RemotePlant
+            self.plant = RemotePlant(remote, plant_name, log_channels=log_channels, constants=constants, solver=solver)
         self.pid_controller = PID()
+        self.cache = cache  # optional cache.ResultCache, may be shared between several systems
+        self.archive = archive  # optional trajstore.TrajectoryStore, results persisted on disk behind the cache
+        self.instrumentation = instrumentation  # optional instrumentation.Instrumentation, None costs nothing
+        self.termination = termination  # optional termination.Termination, early stop criteria
+        self.stop_reason = None  # why the last run stopped early (None when it reached runtime), arrays for batches
+        self.stop_time = None
 
-    def run(self, params):
-        self.reset()
+        # multi-rate: params' dt is the controller period, the plant is integrated in substeps intervals per period
+        # with the controller output held, and only every decimation-th controller step ends up in the output
+        if int(substeps) < 1 or int(decimation) < 1:
+            raise ValueError('substeps and decimation have to be positive integers')
+        self.substeps = int(substeps)
+        self.decimation = int(decimation)
+
+        # checkpoints of the last run: a rerun that only differs in runtime resumes from the latest one it can use
+        self.checkpoint_every = checkpoint_every  # in steps, 0 disables checkpointing
+        self.checkpoint_key = None
+        self.checkpoints = []  # (sample, pid snapshot, plant snapshot, feedback), taken before computing that sample
+        self.trajectory = np.empty(0)  # output of the last run, valid up to len(self.trajectory)
+        if lti and hasattr(self.plant, 'lti'):
+            self.plant.lti = True  # only linear plants offer the exact discretization
+
+    def run(self, params, abort=None):
+        # abort is an optional callable polled every step, returning True stops the run and None is returned
+        result = self.lookup(params)
+        if result is None:
+            result = self.simulate(params, abort)
+            self.store(params, result)
+        return result
+
+    def lookup(self, params):
+        # the cached (or archived) result of run(params), or None
+        if self.plant.log.enabled:
+            return None  # a cache hit would leave the plant log empty
+        result = None
+        if self.cache is not None:
+            result = self.cache.get(self.cache.key(self.plant_name, self.plant, params, *self.options()))
+        if result is None and self.archive is not None:
+            result = self.archive.get(self.archive.key(self.plant_name, self.plant, params, *self.options()))
+            if result is not None and self.cache is not None:
+                self.cache.put(self.cache.key(self.plant_name, self.plant, params, *self.options()), result)
+        if result is not None and self.termination is not None:
+            self.scan(params[0], *result, finish=False)  # restores stop_reason and stop_time of the cached run
+        return result
+
+    def store(self, params, result):
+        if result is None or self.plant.log.enabled:
+            return
+        for cache in (self.cache, self.archive):
+            if cache is not None:
+                cache.put(cache.key(self.plant_name, self.plant, params, *self.options()), result)
+
+    def options(self):
+        # everything besides params and plant constants that changes the trajectory
+        term = None if self.termination is None else self.termination.options()
+        solver = getattr(self.plant, 'solver', None)  # resolved settings, remote plants get them from the server
+        return (self.pid_controller.beta, self.pid_controller.gamma, getattr(self.plant, 'lti', False), self.substeps,
+                self.decimation, term, None if solver is None else tuple(sorted(solver.items())))
+
+    def simulate(self, params, abort=None):
+        return finish(self._simulation(params, abort))
+
+    def _simulation(self, params, abort, chunk=None):
+        # generator behind simulate and stream, see _simulate. Its return value is the result.
+        inst = self.instrumentation
+        if inst is None:
+            return (yield from self._simulate(params, abort, None, chunk))
+
+        inst.begin_run(self.plant_name, self.plant, params)
+        result = None
+        try:
+            result = yield from self._simulate(params, abort, inst, chunk)
+        finally:
+            inst.end_run(self.plant, completed=result is not None)
+        return result
+
+    def _simulate(self, params, abort, inst, chunk=None):
+        # generator returning the result of a run. With chunk it yields (x, output, m) whenever output[:m] has grown by
+        # another 1, 2, 4, ... up to chunk samples, the restored prefix first. Closing it remembers what was computed.
         setpoint, runtime, dt, Kp, Ki, Kd = params
-        output = []
-        fdbk = 0
-        x = np.arange(0, runtime + dt, dt)
+        steps = np.arange(0, runtime + dt, dt)  # controller time grid
+        dec, sub = self.decimation, self.substeps
+        x = steps[::dec]
+        self.reset(len(steps) * sub)
+        self.stop_reason = self.stop_time = None
+        term = self.termination
+        if getattr(self.plant, 'lti', False):
+            # the whole loop is one linear filter, no per-step python required. The discretization is exact under
+            # the zero-order hold, so substeps change nothing here.
+            beta, gamma = self.pid_controller.beta, self.pid_controller.gamma
+            start = perf_counter()
+            x, output = self.plant.closed_loop(setpoint, runtime, dt, Kp, Ki, Kd, beta, gamma)
+            x, output = x[::dec], output[::dec].copy()
+            if inst is not None:
+                inst.current['phases']['plant'] += perf_counter() - start
+            return (x, output) if term is None else self.scan(setpoint, x, output)
+        output = np.empty(len(x))
+        start, fdbk = self.resume(params, output)
+        every = self.checkpoint_every
+        size, mark = 1, start if chunk else len(x)  # the next chunk is handed out once output[mark] is computed
+        if chunk and start:
+            try:
+                yield x, output, start
+            except GeneratorExit:
+                self.remember(output[:start])
+                raise
+        gains = Kp, Ki, Kd
+        h = dt / sub  # plant integration interval
+        advance = getattr(self.plant, 'advance', None) if sub > 1 else None  # remote plants hold in one round trip
 
-        for t in x:
-            pid_val = self.pid_controller.pid(setpoint, fdbk, Kp, Ki, Kd, dt)
-            fdbk = self.plant.update(pid_val, t, dt)
-            output += [fdbk]
+        if term is not None:
+            term.start(setpoint)
+            if start:
+                # replay the criteria over the restored prefix so the run stops exactly where a fresh one would
+                n = self.scan(setpoint, x[:start], output[:start], finish=False)
+                if n is not None:
+                    return term.finish(x, output, n)
+
+        for n in range(start * dec, len(steps)):
+            m, skip = divmod(n, dec)  # output sample, controller steps since it was taken
+            if not skip:
+                if abort is not None and abort():
+                    self.remember(output[:m])
+                    return None
+                if every and m % every == 0 and m > start:  # the resumed step is already checkpointed
+                    self.checkpoints.append((m, self.pid_controller.snapshot(), self.plant.snapshot(), fdbk))
+            fdbk = self._step(steps[n], fdbk, setpoint, gains, dt, h, advance, inst)
+            if skip:
+                continue
+            output[m] = fdbk
+            if term is not None:
+                # checked on the logged samples only, so a rerun from the cache or checkpoints stops at the same one
+                reason = term.check(x[m], fdbk)
+                if reason is not None:
+                    self.remember(output[:m + 1])
+                    self.stop_reason, self.stop_time = reason, x[m]
+                    return term.finish(x, output, m)
+            if m == mark:
+                try:
+                    yield x, output, m + 1
+                except GeneratorExit:
+                    self.remember(output[:m + 1])
+                    raise
+                size = min(2 * size, chunk)
+                mark += size
         # plant.plot()
+        self.remember(output)
+        return x, output
+
+    def _step(self, t, fdbk, setpoint, gains, dt, h, advance, inst):
+        # one controller step from t: the PID output is applied for the first of the substeps plant updates of h and
+        # held (as 0, the plants accumulate it) for the rest. Returns the feedback at the end of the step.
+        Kp, Ki, Kd = gains
+        if inst is None:
+            pid_val = self.pid_controller.pid(setpoint, fdbk, Kp, Ki, Kd, dt)
+            if advance is not None:
+                return advance(pid_val, t, h, self.substeps)
+            fdbk = self.plant.update(pid_val, t, h)
+            for k in range(1, self.substeps):
+                fdbk = self.plant.update(0, t + k * h, h)
+            return fdbk
+        t0 = perf_counter()
+        pid_val = self.pid_controller.pid(setpoint, fdbk, Kp, Ki, Kd, dt)
+        t1 = perf_counter()
+        fdbk = self.plant.update(pid_val, t, h)  # per update so the plant's share is timed, advance is not used
+        for k in range(1, self.substeps):
+            fdbk = self.plant.update(0, t + k * h, h)
+        inst.step(t1 - t0, perf_counter() - t1)
+        return fdbk
+
+    def scan(self, setpoint, x, output, finish=True):
+        # runs the termination criteria over an already computed trajectory. With finish the padded/truncated result
+        # is returned, otherwise the step the run stops at (or None).
+        term = self.termination.start(setpoint)
+        self.stop_reason = self.stop_time = None
+        for n, fdbk in enumerate(output):
+            reason = term.check(x[n], fdbk)
+            if reason is not None:
+                self.stop_reason, self.stop_time = reason, x[n]
+                if not finish:
+                    return n
+                return term.finish(x, output if output.flags.writeable else output.copy(), n)
+        return (x, output) if finish else None
+
+    # STREAMING ------------------------------------------------------------------------------------------------------
+    def stream(self, params, chunk=64, pace=None):
+        # yields (t, y) chunks of up to `chunk` output samples while they are computed and returns what run would
+        # return. It is run in pieces: the cache, checkpoints, instrumentation and termination all apply, a cached
+        # result comes back as one chunk and a run stopped by termination streams up to the stop without padding.
+        # Chunks start at one sample and double, the first pixel should not wait for a full chunk. pace=1.0 plays
+        # back in real time (2.0 twice as fast, None as fast as possible). runtime may be None (or inf) for an
+        # open-ended run, see _stream_open.
+        runtime = params[1]
+        if runtime is None or not np.isfinite(runtime):
+            return (yield from self._stream_open(params, chunk, pace))
+
+        result = self.lookup(params)
+        sent, clock = 0, None
+        if result is None:
+            steps = self._simulation(params, None, chunk)
+            try:
+                while True:
+                    x, output, m = next(steps)
+                    if pace:
+                        clock = clock or perf_counter() - x[m - 1] / pace  # playback starts at the first chunk
+                        sleep(max(0.0, clock + x[m - 1] / pace - perf_counter()))
+                    yield x[sent:m].copy(), output[sent:m].copy()
+                    sent = m
+            except StopIteration as stop:
+                result = stop.value
+            finally:
+                steps.close()
+            self.store(params, result)
+        x, y = result
+        stopped = self.termination is not None and self.stop_time is not None
+        end = int(np.searchsorted(x, self.stop_time)) + 1 if stopped else len(x)
+        if end > sent:
+            if pace and clock:
+                sleep(max(0.0, clock + x[end - 1] / pace - perf_counter()))
+            yield x[sent:end].copy(), y[sent:end].copy()
+        return result
+
+    def _stream_open(self, params, chunk, pace):
+        # the open-ended stream, ended by closing the generator or by termination. Only the current chunk is held,
+        # there is no result to cache or checkpoint. Instrumentation applies.
+        inst = self.instrumentation
+        if inst is not None:
+            inst.begin_run(self.plant_name, self.plant, params)
+        completed = False
+        try:
+            yield from self._open_steps(params, chunk, pace, inst)
+            completed = True
+        finally:
+            if inst is not None:
+                inst.end_run(self.plant, completed=completed)
+
+    def _open_steps(self, params, chunk, pace, inst):
+        setpoint, runtime, dt, Kp, Ki, Kd = params
+        dec, sub = self.decimation, self.substeps
+        gains = Kp, Ki, Kd
+        h = dt / sub
+        advance = getattr(self.plant, 'advance', None) if sub > 1 else None
+        self.reset()
+        self.stop_reason = self.stop_time = None
+        term = self.termination
+        if term is not None:
+            term.start(setpoint)
+
+        t_chunk, y_chunk = np.empty(chunk), np.empty(chunk)
+        fill, size, fdbk = 0, 1, 0
+        start = perf_counter()
+        for n in itertools.count():
+            t = n * dt  # the grid a finite run would use, np.arange(0, runtime + dt, dt)
+            fdbk = self._step(t, fdbk, setpoint, gains, dt, h, advance, inst)
+            if n % dec:
+                continue
+            t_chunk[fill], y_chunk[fill] = t, fdbk
+            fill += 1
+            reason = None if term is None else term.check(t, fdbk)
+            if reason is not None:
+                self.stop_reason, self.stop_time = reason, t
+                break
+            if fill == size:
+                if pace:
+                    sleep(max(0.0, start + t / pace - perf_counter()))
+                yield t_chunk[:fill].copy(), y_chunk[:fill].copy()
+                fill, size = 0, min(2 * size, chunk)
+        if fill:
+            if pace:
+                sleep(max(0.0, start + t_chunk[fill - 1] / pace - perf_counter()))
+            yield t_chunk[:fill].copy(), y_chunk[:fill].copy()
+
+    # CHECKPOINTS ------------------------------------------------------------------------------------------------------
+    def resume(self, params, output):
+        # restores the latest checkpoint shared with the previous run, copies its output prefix and returns the sample
+        # to continue from with the controller's feedback at that point. Anything that changes the trajectory from
+        # t=0 on starts over.
+        setpoint, runtime, dt, Kp, Ki, Kd = params
+        key = (setpoint, dt, Kp, Ki, Kd, self.options(), tuple(sorted(self.plant.parameters().items())))
+        if not self.checkpoint_every or self.plant.log.enabled or key != self.checkpoint_key:
+            self.checkpoint_key = key
+            self.checkpoints = []
+            self.trajectory = np.empty(0)
+            return 0, 0
+
+        if len(output) <= len(self.trajectory):
+            output[:] = self.trajectory[:len(output)]  # shorter rerun, keep the longer memory untouched
+            return len(output), output[-1]
+
+        self.checkpoints = [c for c in self.checkpoints if c[0] <= len(self.trajectory)]
+        if not self.checkpoints:
+            return 0, 0
+        n, pid_state, plant_state, fdbk = self.checkpoints[-1]
+        self.pid_controller.restore(pid_state)
+        self.plant.restore(plant_state)
+        output[:n] = self.trajectory[:n]
+        return n, fdbk
+
+    def remember(self, output):
+        if self.checkpoint_every and len(output) >= len(self.trajectory):
+            self.trajectory = output
+
+    def run_batch(self, params, gains, monitor=None, constants=None):
+        # advance N closed loops together, one per row of the (N, 3) array of (Kp, Ki, Kd) gains. monitor is an
+        # optional callable monitor(n, t, fdbk, alive) called after every step with the feedback of the still running
+        # rows (alive holds their row numbers); returning a boolean mask over them abandons the False rows, whose
+        # remaining output is left NaN. Rows stopped by self.termination are padded per its pad mode instead.
+        # substeps and decimation apply as in run; the monitor still sees every controller step. constants overrides
+        # plant constants, per row when given as (N,) arrays (see montecarlo).
+        setpoint, runtime, dt = params[:3]
+        dec, sub = self.decimation, self.substeps
+        controller = PIDBank(gains)
+        controller.beta = self.pid_controller.beta
+        controller.gamma = self.pid_controller.gamma
+        term = self.termination
+        stop_code = np.zeros(controller.size, dtype=int)
+        stop_index = np.full(controller.size, -1)
+        if constants is not None:
+            constants = dict(self.plant.constants, **constants)
+            rows = {name: np.ndim(value) == 1 for name, value in constants.items()}  # per row, otherwise shared
+
+        if getattr(self.plant, 'lti', False):
+            beta, gamma = controller.beta, controller.gamma
+            x = np.arange(0, runtime + dt, dt)[::dec]
+            output = np.empty((controller.size, len(x)))
+            for row, g in enumerate(np.atleast_2d(gains)):
+                c = None if constants is None else {name: v[row] if rows[name] else v for name, v in constants.items()}
+                output[row] = self.plant.closed_loop(setpoint, runtime, dt, *g, beta, gamma, c)[1][::dec]
+            if term is not None:
+                for row in range(controller.size):
+                    n = self.scan(setpoint, x, output[row], finish=False)
+                    if n is not None:
+                        stop_code[row], stop_index[row] = REASONS.index(self.stop_reason) + 1, n
+                        output[row, n + 1:] = np.nan
+        else:
+            X, u = self.plant.batch_state(controller.size, constants)
+            steps = np.arange(0, runtime + dt, dt)
+            x = steps[::dec]
+            h = dt / sub
+            output = np.full((controller.size, len(x)), np.nan)
+            fdbk = np.zeros(controller.size)
+            alive = np.arange(controller.size)
+            if term is not None:
+                term.start(setpoint, controller.size)
+
+            for n, t in enumerate(steps):
+                pid_val = controller.pid(setpoint, fdbk, dt)
+                X, u = self.plant.update_batch(X, u, pid_val, t, h, constants)
+                for k in range(1, sub):
+                    X, u = self.plant.update_batch(X, u, 0, t + k * h, h, constants)
+                fdbk = X[:, self.plant.output_state]
+                m, skip = divmod(n, dec)
+                if not skip:
+                    output[alive, m] = fdbk
+
+                keep = None if monitor is None else monitor(n, t, fdbk, alive)
+                if term is not None and not skip:
+                    codes = term.check_batch(t, fdbk, alive)
+                    stopped = codes > 0
+                    stop_code[alive[stopped]] = codes[stopped]
+                    stop_index[alive[stopped]] = m
+                    keep = ~stopped if keep is None else np.asarray(keep) & ~stopped
+                if keep is not None and not np.all(keep):
+                    alive, X, u, fdbk = alive[keep], X[keep], u[keep], fdbk[keep]
+                    controller.keep(keep)
+                    if constants is not None:
+                        constants = {name: v[keep] if rows[name] else v for name, v in constants.items()}
+                    if not len(alive):
+                        break
+
+        if term is not None:
+            term.finish_batch(output, stop_index)
+            self.stop_reason = np.array([''] + list(REASONS))[stop_code]
+            self.stop_time = np.where(stop_index >= 0, x[stop_index], np.nan)
         return x, output
 
-    def reset(self):
+    def loop_analysis(self, params):
+        # open loop frequency response and margins, linearized where the run is meant to settle (see frequency)
+        import frequency  # scipy.signal and fsolve, only loaded once a loop is analyzed
+        setpoint, runtime, dt, Kp, Ki, Kd = params
+        return frequency.analyze(self.plant, setpoint, dt, Kp, Ki, Kd, t=runtime)
+
+    def autotune(self, setpoint=None, runtime=None, dt=None, cost='ISE', **kwargs):
+        # best (Kp, Ki, Kd) within the plant's control ranges, see tuner.autotune for the options
+        return tuner.autotune(self, setpoint, runtime, dt, cost, **kwargs)
+
+    def reset(self, samples=0):
         self.pid_controller.reset()
-        self.plant.reset()
+        self.plant.reset(samples)  # sizes the plant log up front when logging is enabled
+
+
+def finish(steps):
+    # runs a generator to the end, returns its return value
+    try:
+        while True:
+            next(steps)
+    except StopIteration as stop:
+        return stop.value
 
 
-def get_plant(name):
-    if name == 'Reactor':
-        plant = Reactor()
-    elif name == 'DC Motor':
-        plant = DCMotor()
-    elif name == '2nd Order ODE':
-        plant = SecOrder()
-    else:
-        plant = Reactor()
-    return plant
+def get_plant(name, **kwargs):
+    return plants.create(name, **kwargs)  # raises ValueError for names nobody registered
 
 
 def plot_temporal(x, y, title=''):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(1, 1, constrained_layout=True)
     ax.plot(x, y, '-b')  # scaling is applied.
 
@@ -54,6 +441,84 @@ def plot_temporal(x, y, title=''):
     plt.show()
 
 
+# SWEEP ----------------------------------------------------------------------------------------------------------------
+# one row per gain set; full trajectories stay in the worker
+SWEEP_DTYPE = np.dtype([('Kp', float), ('Ki', float), ('Kd', float),
+                        ('final_error', float), ('overshoot', float), ('ise', float),
+                        ('stop_reason', 'U9'), ('stop_time', float)])
+
+_worker_system = None  # System and its plant are stateful, so every worker process owns exactly one
+
+
+def metrics(x, y, setpoint):
+    y = np.asarray(y)
+    error = setpoint - y
+    direction = np.sign(setpoint - y[0]) or 1  # which side of the setpoint counts as overshoot
+    overshoot = max(0.0, np.max(direction * (y - setpoint)))
+    ise = np.sum(error ** 2) * (x[1] - x[0]) if len(x) > 1 else 0.0
+    return error[-1], overshoot, ise
+
+
+def sweep_row(system, gains, x, y, setpoint):
+    # one SWEEP_DTYPE record for the run system just finished
+    stop_time = np.nan if system.stop_time is None else system.stop_time
+    return tuple(gains) + tuple(metrics(x, y, setpoint)) + (system.stop_reason or '', stop_time)
+
+
+def _init_worker(plant_name, lti, termination, archive=None):
+    global _worker_system
+    if archive is not None:
+        from trajstore import TrajectoryStore
+        archive = TrajectoryStore(archive)
+    _worker_system = System(plant_name, lti, termination=termination, archive=archive)
+
+
+def _run_chunk(sim_params, gains, start=0, spec=None):
+    setpoint, runtime, dt = sim_params
+    trajectories = None if spec is None else attach(spec)
+    rows = []
+    for n, (Kp, Ki, Kd) in enumerate(gains):
+        x, y = _worker_system.run((setpoint, runtime, dt, Kp, Ki, Kd))
+        rows.append(sweep_row(_worker_system, (Kp, Ki, Kd), x, y, setpoint))
+        if trajectories is not None:
+            trajectories[start + n] = y
+    return rows
+
+
+def sweep(plant_name, kp_values, ki_values, kd_values, setpoint=None, runtime=None, dt=None,
+          workers=None, chunksize=None, lti=False, termination=None, trajectories=False, archive=None):
+    # runs every (Kp, Ki, Kd) in the grid across a process pool and returns a SWEEP_DTYPE table in grid order. With
+    # trajectories, (table, x, Y) is returned instead, the workers write every output into the rows of Y directly
+    # (one shared memory block, nothing pickled). archive is the path of a trajstore.TrajectoryStore the workers
+    # look every run up in first and append new ones to.
+    if trajectories and termination is not None and termination.pad == 'truncate':
+        raise ValueError("truncated runs cannot be stacked, use pad 'hold' or 'nan'")
+    controls = get_plant(plant_name).controls
+    setpoint = controls['setpoint'] if setpoint is None else setpoint
+    runtime = controls['runtime'] if runtime is None else runtime
+    dt = controls['stepsize'] if dt is None else dt
+
+    gains = list(itertools.product(kp_values, ki_values, kd_values))
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, -(-len(gains) // (workers * 4)))  # a few chunks per worker keeps the pool balanced
+    chunks = [gains[i:i + chunksize] for i in range(0, len(gains), chunksize)]
+
+    initargs = (plant_name, lti, termination, archive)
+    if not trajectories:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+            rows = executor.map(_run_chunk, itertools.repeat((setpoint, runtime, dt)), chunks)
+            return np.array(list(itertools.chain.from_iterable(rows)), dtype=SWEEP_DTYPE)
+
+    x = np.arange(0, runtime + dt, dt)
+    with SharedBlock((len(gains), len(x))) as block:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+            rows = executor.map(_run_chunk, itertools.repeat((setpoint, runtime, dt)), chunks,
+                                range(0, len(gains), chunksize), itertools.repeat(block.spec))
+            table = np.array(list(itertools.chain.from_iterable(rows)), dtype=SWEEP_DTYPE)
+        return table, x, block.array
+
+
 def main():
     Kp = 500
     Ki = 500
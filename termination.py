@@ -0,0 +1,78 @@
+import numpy as np
+
+PAD_MODES = ('hold', 'nan', 'truncate')
+REASONS = ('nonfinite', 'limit', 'settled')
+
+
+class Termination:
+    # Early stop criteria checked after every simulation step:
+    #   nonfinite   the feedback became nan or inf
+    #   max_abs     |feedback| exceeded this limit
+    #   tolerance   |setpoint - feedback| stayed within this band for `hold` seconds
+    # The output past the stop is padded with the last sample ('hold'), with nan ('nan'), or cut off ('truncate',
+    # batches have no ragged rows and get nan instead).
+    def __init__(self, nonfinite=True, max_abs=None, tolerance=None, hold=None, pad='hold'):
+        if pad not in PAD_MODES:
+            raise ValueError(f'Unknown pad mode {pad}, expected one of {PAD_MODES}')
+        if (tolerance is None) != (hold is None):
+            raise ValueError('tolerance and hold have to be given together')
+        self.nonfinite = nonfinite
+        self.max_abs = max_abs
+        self.tolerance = tolerance
+        self.hold = hold
+        self.pad = pad
+        self.start(0)
+
+    def options(self):
+        return self.nonfinite, self.max_abs, self.tolerance, self.hold, self.pad
+
+    def start(self, setpoint, size=None):
+        self.setpoint = setpoint
+        self.settled_since = None if size is None else np.full(size, np.nan)
+        return self
+
+    # SINGLE RUN -------------------------------------------------------------------------------------------------------
+    def check(self, t, fdbk):
+        # returns the reason to stop, or None to keep going
+        if self.nonfinite and not np.isfinite(fdbk):
+            return 'nonfinite'
+        if self.max_abs is not None and abs(fdbk) > self.max_abs:
+            return 'limit'
+        if self.tolerance is not None:
+            if abs(self.setpoint - fdbk) > self.tolerance:
+                self.settled_since = None
+            elif self.settled_since is None:
+                self.settled_since = t
+            if self.settled_since is not None and t - self.settled_since >= self.hold:
+                return 'settled'
+        return None
+
+    def finish(self, x, output, n):
+        # output[:n + 1] was simulated, the rest is filled in according to pad
+        if self.pad == 'truncate':
+            return x[:n + 1], output[:n + 1]
+        output[n + 1:] = output[n] if self.pad == 'hold' else np.nan
+        return x, output
+
+    # BATCH ------------------------------------------------------------------------------------------------------------
+    def check_batch(self, t, fdbk, alive):
+        # returns an array of reason codes for the alive rows: 0 keeps running, i + 1 stops with REASONS[i]
+        codes = np.zeros(len(fdbk), dtype=int)
+        if self.tolerance is not None:
+            inside = np.abs(self.setpoint - fdbk) <= self.tolerance
+            since = self.settled_since[alive]
+            since = np.where(inside, np.where(np.isnan(since), t, since), np.nan)
+            self.settled_since[alive] = since
+            codes[inside & (t - since >= self.hold)] = 3
+        if self.max_abs is not None:
+            codes[np.abs(fdbk) > self.max_abs] = 2
+        if self.nonfinite:
+            codes[~np.isfinite(fdbk)] = 1
+        return codes
+
+    def finish_batch(self, output, stop_index):
+        # stop_index is -1 for rows that ran to the end
+        for row, n in enumerate(stop_index):
+            if n >= 0 and self.pad == 'hold':
+                output[row, n + 1:] = output[row, n]
+        return output
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import system
+from termination import Termination
+
+# Regression checks for the paths that must agree with a plain System.run: the LTI fast path, checkpoint resume and
+# streaming. Run with  python -m pytest -q
+
+PLANTS = ('Reactor', 'DC Motor', '2nd Order ODE')
+
+
+def params(name, runtime=None):
+    # the plant's own GUI defaults, with a short runtime to keep the checks quick
+    c = system.System(name).plant.controls
+    return c['setpoint'], runtime or min(c['runtime'], 5), c['stepsize'], c['kpset'], c['kiset'], c['kdset']
+
+
+def test_lti_matches_odeint():
+    p = params('2nd Order ODE', runtime=30)
+    lti = system.System('2nd Order ODE', lti=True).run(p)[1]
+    y = system.System('2nd Order ODE').run(p)[1]
+    assert np.allclose(lti, y, rtol=0, atol=1e-5 * np.max(np.abs(y)))
+
+
+@pytest.mark.parametrize('name', PLANTS)
+def test_resumed_run_matches_fresh(name):
+    setpoint, runtime, dt, Kp, Ki, Kd = p = params(name)
+    fresh = system.System(name, checkpoint_every=0).run(p)[1]
+
+    longer = system.System(name, checkpoint_every=10)
+    longer.run((setpoint, runtime / 2, dt, Kp, Ki, Kd))
+    assert np.array_equal(longer.run(p)[1], fresh)
+
+    aborted = system.System(name, checkpoint_every=10)
+    calls = iter(range(10 ** 9))
+    assert aborted.run(p, abort=lambda: next(calls) > len(fresh) // 3) is None
+    assert np.array_equal(aborted.run(p)[1], fresh)
+
+
+@pytest.mark.parametrize('name', PLANTS)
+@pytest.mark.parametrize('termination', [None, Termination(tolerance=1.0, hold=1)])
+def test_stream_matches_run(name, termination):
+    p = params(name)
+    x, y = system.System(name, termination=termination).run(p)
+    steps = system.System(name, termination=termination).stream(p, chunk=16)
+    chunks = []
+    try:
+        while True:
+            chunks.append(next(steps))
+    except StopIteration as stop:
+        result = stop.value
+    assert np.array_equal(result[0], x) and np.array_equal(result[1], y)
+    t, streamed = map(np.concatenate, zip(*chunks))
+    assert np.array_equal(t, x[:len(t)]) and np.array_equal(streamed, y[:len(t)])
+
+
+@pytest.mark.parametrize('name', PLANTS)
+def test_open_stream_matches_run(name):
+    p = params(name)
+    y = system.System(name).run(p)[1]
+    steps = system.System(name).stream(p[:1] + (None,) + p[2:], chunk=16)
+    streamed = np.concatenate([next(steps)[1] for _ in range(8)])
+    steps.close()
+    assert np.array_equal(streamed, y[:len(streamed)])
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl  # serializes appends from several processes, POSIX only
+except ImportError:
+    fcntl = None
+
+# TRAJECTORY STORE -----------------------------------------------------------------------------------------------------
+# Append-only on-disk archive of System.run results, so sweeps and tuning sessions survive the process. A store is a
+# directory of two files:
+#
+#   data.f64    every trajectory as float64, x then y, one after the other
+#   index.bin   one INDEX_DTYPE record per trajectory: plant, digest, setpoint, runtime, dt, Kp, Ki, Kd, offset, length
+#
+# The digest hashes the plant constants and System.options(), so a run is only found again with the same physics and
+# simulation options. The index is small and read whole, the data file is memory mapped and a curve is only paged in
+# when its arrays are touched. Records are appended after their data, a reader never sees a record without its curve.
+#
+#   store = TrajectoryStore('runs')
+#   System('Reactor', archive=store)           # consulted before simulating, every new run appended
+#   store.load(store.query('Reactor', Kp=(20, 60), Kd=0)[0])
+
+INDEX_DTYPE = np.dtype([('plant', 'S24'), ('digest', '<u8'), ('setpoint', '<f8'), ('runtime', '<f8'), ('dt', '<f8'),
+                        ('Kp', '<f8'), ('Ki', '<f8'), ('Kd', '<f8'), ('offset', '<i8'), ('length', '<i8')])
+PARAMS = ('setpoint', 'runtime', 'dt', 'Kp', 'Ki', 'Kd')
+
+
+def _plant_field(plant_name):
+    # the index holds the name in a fixed S24 field, a longer one would be truncated and collide with its prefix
+    encoded = plant_name.encode()
+    if len(encoded) > INDEX_DTYPE['plant'].itemsize:
+        raise ValueError(f'Plant name {plant_name!r} is longer than the {INDEX_DTYPE["plant"].itemsize} bytes the '
+                         f'trajectory index stores')
+    return encoded
+
+
+class TrajectoryStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, 'index.bin')
+        self.data_path = os.path.join(path, 'data.f64')
+        for name in (self.index_path, self.data_path):
+            open(name, 'ab').close()
+        self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.rows = {}  # key -> index row
+        self.data = None  # memmap of data.f64, remapped when it has grown past the end
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def key(self, plant_name, plant, params, *options):
+        # same signature as ResultCache.key
+        constants = tuple((name, float(value)) for name, value in sorted(plant.parameters().items()))
+        digest = hashlib.blake2b(repr((constants, options)).encode(), digest_size=8).digest()
+        return (_plant_field(plant_name), int.from_bytes(digest, 'little')) + tuple(float(p) for p in params)
+
+    def refresh(self):
+        # picks up records other processes appended since the last look
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        known = len(self.index) * INDEX_DTYPE.itemsize
+        new = (os.path.getsize(self.index_path) - known) // INDEX_DTYPE.itemsize
+        if new <= 0:
+            return
+        records = np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=new, offset=known)
+        for n, record in enumerate(records[list(INDEX_DTYPE.names[:8])].tolist(), len(self.index)):
+            self.rows.setdefault(record, n)
+        self.index = np.concatenate((self.index, records))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        self.refresh()
+        return key in self.rows
+
+    def get(self, key):
+        self.refresh()
+        row = self.rows.get(key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.load(row)
+
+    def load(self, row):
+        # (x, y) of one index row as read-only views of the mapped file
+        offset, length = int(self.index['offset'][row]), int(self.index['length'][row])
+        with self._lock:
+            if self.data is None or len(self.data) < offset + 2 * length:
+                self.data = np.memmap(self.data_path, dtype='<f8', mode='r')
+            data = self.data
+        return np.asarray(data[offset:offset + length]), np.asarray(data[offset + length:offset + 2 * length])
+
+    def put(self, key, result):
+        x, y = (np.ascontiguousarray(array, dtype='<f8') for array in result)
+        if len(x) != len(y):
+            raise ValueError(f'x and y differ in length: {len(x)} and {len(y)}')
+        with self._lock, open(self.index_path, 'ab') as index:
+            if fcntl is not None:
+                fcntl.flock(index, fcntl.LOCK_EX)  # released when the file is closed
+            self._refresh()  # another process may have stored it meanwhile
+            if key in self.rows:
+                return result
+            with open(self.data_path, 'ab') as data:
+                offset = data.seek(0, os.SEEK_END) // 8
+                data.write(x.tobytes())
+                data.write(y.tobytes())
+            record = np.array([key + (offset, len(x))], dtype=INDEX_DTYPE)
+            index.write(record.tobytes())
+            index.flush()
+            self.rows[key] = len(self.index)
+            self.index = np.concatenate((self.index, record))
+        return result
+
+    def query(self, plant_name=None, **ranges):
+        # index rows matching a plant and ranges over PARAMS, each given as (low, high) inclusive or an exact value:
+        #   store.query('DC Motor', Kp=(100, 500), dt=0.05)
+        self.refresh()
+        unknown = set(ranges) - set(PARAMS)
+        if unknown:
+            raise ValueError(f'Unknown query fields {sorted(unknown)}, expected some of {PARAMS}')
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if plant_name is not None:
+            mask &= index['plant'] == _plant_field(plant_name)
+        for name, bounds in ranges.items():
+            if np.ndim(bounds) == 0:
+                mask &= index[name] == bounds
+            else:
+                low, high = bounds
+                mask &= (index[name] >= low) & (index[name] <= high)
+        return np.flatnonzero(mask)
+
+    def stats(self):
+        return {'entries': len(self.index), 'bytes': os.path.getsize(self.data_path), 'hits': self.hits,
+                'misses': self.misses}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List trajectories in a store, optionally filtered by gains.')
+    parser.add_argument('path', help='store directory')
+    parser.add_argument('--plant', default=None)
+    for name in PARAMS:
+        parser.add_argument(f'--{name.lower()}', dest=name, type=float, nargs=2, metavar=('LOW', 'HIGH'), default=None)
+    parser.add_argument('--plot', action='store_true', help='plot the matching curves')
+    args = parser.parse_args(argv)
+
+    store = TrajectoryStore(args.path)
+    rows = store.query(args.plant, **{name: getattr(args, name) for name in PARAMS if getattr(args, name)})
+    print(f'{len(rows)} of {len(store)} trajectories')
+    print(f"{'plant':<16}" + ''.join(f'{name:>10}' for name in PARAMS) + f"{'samples':>10}")
+    for record in store.index[rows]:
+        print(f"{record['plant'].decode():<16}" + ''.join(f'{record[name]:>10.4g}' for name in PARAMS)
+              + f"{record['length']:>10}")
+    if args.plot and len(rows):
+        import matplotlib.pyplot as plt
+        for row in rows:
+            x, y = store.load(row)
+            record = store.index[row]
+            plt.plot(x, y, label=f"Kp {record['Kp']:g} Ki {record['Ki']:g} Kd {record['Kd']:g}")
+        plt.xlabel('time (s)')
+        plt.legend()
+        plt.grid()
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import numpy as np
+
+# AUTO TUNING ----------------------------------------------------------------------------------------------------------
+# Minimizes a step response cost over (Kp, Ki, Kd) inside the plant's slider ranges. A Latin hypercube covers the box
+# first, then batches of candidates are drawn around the incumbent with a shrinking radius. Every batch goes through
+# System.run_batch, and a candidate is abandoned as soon as its running cost passes the incumbent's, all costs below
+# only ever grow with time.
+
+COSTS = ('ISE', 'ITAE', 'overshoot')
+
+
+class CostMonitor:
+    # run_batch monitor accumulating the cost of every row and pruning the hopeless ones
+    def __init__(self, cost, setpoint, dt, size, initial, incumbent=np.inf, penalty=10.0):
+        if cost not in COSTS:
+            raise ValueError(f'Unknown cost {cost}, expected one of {COSTS}')
+        self.cost = cost
+        self.setpoint = setpoint
+        self.dt = dt
+        self.incumbent = incumbent
+        self.penalty = penalty  # seconds, weighs overshoot**2 against the integrated squared error
+        self.direction = np.sign(setpoint - initial) or 1
+        self.integral = np.zeros(size)
+        self.overshoot = np.zeros(size)
+
+    def values(self, rows=slice(None)):
+        if self.cost == 'overshoot':
+            return self.integral[rows] + self.penalty * self.overshoot[rows] ** 2
+        return self.integral[rows]
+
+    def total(self, x, y):
+        # whole trajectories at once, for runs that were not monitored step by step
+        error = self.setpoint - y
+        if self.cost == 'ITAE':
+            self.integral = np.sum(x * np.abs(error), axis=1) * self.dt
+        else:
+            self.integral = np.sum(error ** 2, axis=1) * self.dt
+        self.overshoot = np.maximum(0.0, np.max(-self.direction * error, axis=1))
+        return self.values()
+
+    def __call__(self, n, t, fdbk, alive):
+        error = self.setpoint - fdbk
+        if self.cost == 'ITAE':
+            self.integral[alive] += t * np.abs(error) * self.dt
+        else:
+            self.integral[alive] += error ** 2 * self.dt
+        if self.cost == 'overshoot':
+            self.overshoot[alive] = np.maximum(self.overshoot[alive], -self.direction * error)
+        partial = self.values(alive)
+        return np.isfinite(partial) & (partial <= self.incumbent)
+
+
+def evaluate(system, params, gains, cost, incumbent=np.inf, penalty=10.0):
+    # returns the cost of every row of gains, inf for the abandoned ones
+    setpoint, runtime, dt = params
+    plant = system.plant
+    initial = plant.batch_state(1)[0][0, plant.output_state]
+    monitor = CostMonitor(cost, setpoint, dt, len(gains), initial, incumbent, penalty)
+
+    if getattr(plant, 'lti', False):
+        x, y = system.run_batch(params, gains)  # the linear fast path has no step loop to hook into
+        monitor.dt = dt * system.decimation  # only every decimation-th step is in y
+        costs = monitor.total(x, y)
+    else:
+        x, y = system.run_batch(params, gains, monitor=monitor)
+        costs = monitor.values()
+    costs[~np.isfinite(y[:, -1]) | ~np.isfinite(costs)] = np.inf
+    return costs
+
+
+def autotune(system, setpoint=None, runtime=None, dt=None, cost='ISE', bounds=None, samples=64, batch=32,
+             rounds=8, radius=0.2, penalty=10.0, seed=None, callback=None):
+    controls = system.plant.controls
+    setpoint = controls['setpoint'] if setpoint is None else setpoint
+    runtime = controls['runtime'] if runtime is None else runtime
+    dt = controls['stepsize'] if dt is None else dt
+    if bounds is None:
+        bounds = [(controls[f'{k}min'], controls[f'{k}max']) for k in ('kp', 'ki', 'kd')]
+    lo, hi = np.array(bounds, dtype=float).T
+    span = np.where(hi > lo, hi - lo, 0.0)
+    params = (setpoint, runtime, dt)
+    rng = np.random.default_rng(seed)
+
+    # global sampler over the whole box
+    from scipy.stats import qmc  # scipy.stats takes most of a second to import, only pay for it when tuning
+    candidates = lo + qmc.LatinHypercube(d=3, seed=rng).random(samples) * span
+    costs = evaluate(system, params, candidates, cost, penalty=penalty)
+    best = int(np.argmin(costs))
+    gains, best_cost = candidates[best], costs[best]
+    evaluated = samples
+    if callback is not None:
+        callback(0, gains, best_cost)
+
+    # local refinement around the incumbent, abandoning anything that cannot beat it
+    for round_ in range(1, rounds + 1):
+        steps = rng.normal(scale=radius, size=(batch, 3)) * span
+        candidates = np.clip(gains + steps, lo, hi)
+        costs = evaluate(system, params, candidates, cost, incumbent=best_cost, penalty=penalty)
+        evaluated += batch
+        best = int(np.argmin(costs))
+        if costs[best] < best_cost:
+            gains, best_cost = candidates[best], costs[best]
+        else:
+            radius *= 0.5
+        if callback is not None:
+            callback(round_, gains, best_cost)
+
+    return {'gains': tuple(float(g) for g in gains), 'cost': float(best_cost), 'metric': cost,
+            'evaluated': evaluated}